@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_PERSIST = os.getenv("ANSWER_CACHE_PERSIST", "false").lower() == "true"
+DB_PATH = os.getenv("DB_PATH")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different phrasings share a key."""
+    return re.sub(r"\s+", " ", query.lower()).strip(" ?!.")
+
+
+def scope_key(tool_names) -> str:
+    """Hash a set of tool names; stored with each entry to record the tools it was built from."""
+    return hashlib.sha256("\n".join(sorted(tool_names)).encode()).hexdigest()
+
+
+class AnswerCache:
+    """
+    Semantic cache of final answers keyed on normalized query embeddings.
+
+    Lookups return the nearest cached answer whose source tools are all still
+    loaded and whose cosine similarity is at least ANSWER_CACHE_THRESHOLD. An
+    entry is scoped to the tools it was built from, so adding or removing other
+    documents leaves it valid; changing one of its own documents drops it through
+    invalidate(). Questions differing only in the drug ("max dose of ibuprofen"
+    and "of naproxen") embed almost identically, so an entry also records the
+    drug tools its question named and only serves questions naming the same
+    ones, all of which it must have used. Entries are evicted
+    least-recently-used beyond ANSWER_CACHE_MAX_ENTRIES and after
+    ANSWER_CACHE_TTL seconds, and can optionally be persisted to SQLite next to
+    DB_PATH.
+    """
+
+    def __init__(self, persist_path: str | None = None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        if persist_path:
+            self.conn = sqlite3.connect(persist_path, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS answer_cache (
+                    id TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    response TEXT NOT NULL,
+                    context TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    drugs TEXT NOT NULL DEFAULT '[]',
+                    created_at REAL NOT NULL
+                );
+            """)
+            if "drugs" not in [column[1] for column in self.conn.execute("PRAGMA table_info(answer_cache)")]:
+                # Older entries did not record the drugs their question named, so they cannot be checked.
+                self.conn.execute("ALTER TABLE answer_cache ADD COLUMN drugs TEXT NOT NULL DEFAULT '[]';")
+                self.conn.execute("DELETE FROM answer_cache;")
+            self.conn.commit()
+            self._load()
+
+    def _load(self):
+        rows = self.conn.execute(
+            "SELECT id, scope, embedding, response, context, sources, drugs, created_at FROM answer_cache ORDER BY created_at"
+        ).fetchall()
+        for id, scope, embedding, response, context, sources, drugs, created_at in rows:
+            self._entries[id] = {
+                "scope": scope,
+                "vector": np.frombuffer(embedding, dtype=np.float32),
+                "response": response,
+                "context": json.loads(context),
+                "sources": set(json.loads(sources)),
+                "drugs": set(json.loads(drugs)),
+                "created_at": created_at,
+            }
+        self._evict()
+
+    def _delete(self, ids):
+        for id in ids:
+            self._entries.pop(id, None)
+        if self.conn and ids:
+            self.conn.executemany("DELETE FROM answer_cache WHERE id = ?", [(id,) for id in ids])
+            self.conn.commit()
+
+    def _evict(self):
+        now = time.time()
+        expired = [id for id, entry in self._entries.items() if now - entry["created_at"] > ANSWER_CACHE_TTL]
+        overflow = list(self._entries)[:max(0, len(self._entries) - len(expired) - ANSWER_CACHE_MAX_ENTRIES)]
+        self._delete(expired + [id for id in overflow if id not in expired])
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, embedding, tool_names, drugs=()) -> dict | None:
+        """
+        Return the closest cached answer built only from the given tools, or None on a miss.
+
+        Args:
+            embedding: Embedding of the normalized query.
+            tool_names: Names of the tools currently loaded.
+            drugs: Names of the drug tools the question names (tool_router.exact_matches).
+
+        Returns:
+            dict | None: {"response", "context", "sources"} of the cached entry.
+        """
+        vector = self._normalize(embedding)
+        available = set(tool_names)
+        drugs = set(drugs)
+        with self._lock:
+            self._evict()
+            ids = [
+                id for id, entry in self._entries.items()
+                if entry["sources"] <= available and entry["drugs"] == drugs and drugs <= entry["sources"]
+            ]
+            if ids:
+                scores = np.stack([self._entries[id]["vector"] for id in ids]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= ANSWER_CACHE_THRESHOLD:
+                    self.hits += 1
+                    self._entries.move_to_end(ids[best])
+                    entry = self._entries[ids[best]]
+                    return {"response": entry["response"], "context": entry["context"], "sources": entry["sources"]}
+            self.misses += 1
+            return None
+
+    def put(self, embedding, response: str, context: list[str], sources, drugs=()):
+        """Store an answer together with the tools it was built from and the drug tools its question named."""
+        entry = {
+            "scope": scope_key(sources),
+            "vector": self._normalize(embedding),
+            "response": response,
+            "context": context,
+            "sources": set(sources),
+            "drugs": set(drugs),
+            "created_at": time.time(),
+        }
+        id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[id] = entry
+            if self.conn:
+                self.conn.execute(
+                    "INSERT INTO answer_cache (id, scope, embedding, response, context, sources, drugs, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (id, entry["scope"], entry["vector"].tobytes(), response, json.dumps(context), json.dumps(sorted(entry["sources"])),
+                     json.dumps(sorted(entry["drugs"])), entry["created_at"])
+                )
+                self.conn.commit()
+            self._evict()
+
+    def invalidate(self, tool_name: str):
+        """Drop every entry whose answer was built from the given tool."""
+        with self._lock:
+            self._delete([id for id, entry in self._entries.items() if tool_name in entry["sources"]])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+answer_cache = AnswerCache(
+    os.path.join(os.path.dirname(DB_PATH) or ".", "answer_cache.sqlite3")
+    if ANSWER_CACHE_PERSIST and DB_PATH else None
+)
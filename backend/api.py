@@ -1,11 +1,25 @@
 import os
-import shutil
+import json
+import time
 import asyncio
-from quart import Quart, request, jsonify, Response, send_file
+from quart import Quart, request, jsonify, Response, send_file, g
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from llama_index.core import Settings
 from quart_cors import cors
-from rag import handle_upload, query_document, load_query_tool, delete_document, evaluate_sample
-from database import (init_db, insert_pdf_file, delete_pdf_file, get_all_files, 
-                      insert_chat_message, get_all_chat_messages, insert_chat, get_all_chats, delete_chat, update_chat_name, delete_messages_after)
+from answer_cache import answer_cache
+from embedding_cache import CachedEmbedding
+from metrics import (start_trace, trace_summary, log, REQUEST_SECONDS, TOOLS_LOADED,
+                     DOCUMENTS_REGISTERED, INGESTION_JOBS, CACHE_HIT_RATE)
+from jobs import ingestion_jobs
+from conversation_memory import load_history, update_summary
+from evaluation import evaluation_runner
+from warmup import tool_warmup
+from registry import document_registry, REGISTRY_POLL_SECONDS
+from tool_router import tool_router, drug_name
+from rag import (handle_upload, update_document, query_document, stream_query_document, search_documents, delete_document,
+                 forget_document, reset_vector_client, query_path_counts)
+from database import (run_db, init_db, insert_pdf_file, delete_pdf_file, get_file, get_all_files, record_document_change,
+                      store_context_chunks, get_context_chunks, insert_chat_message, get_chat_messages, get_all_chat_messages, reset_chat_summary_after, get_evaluation_report, insert_chat, get_all_chats, delete_chat, update_chat_name, delete_messages_after)
 from dotenv import load_dotenv
 
 import nest_asyncio
@@ -15,40 +29,144 @@ load_dotenv()
 init_db()  
 
 folder_path = os.getenv("FOLDER_PATH")
-storage_context_path = os.getenv("STORAGE_CONTEXT_PATH")
+CONTEXT_SNIPPET_CHARS = int(os.getenv("CONTEXT_SNIPPET_CHARS", "200"))
+SEARCH_DEFAULT_K = int(os.getenv("SEARCH_DEFAULT_K", "10"))
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "50"))
 app = Quart(__name__)
 app = cors(app, allow_origin=["http://localhost:5173", "http://127.0.0.1:5173"])
 
+# Per-worker state. Documents are kept in step with other workers through the
+# shared registry (see registry.py); chats are always read from the database.
 tools = []
 all_files = []
-all_chats = []
-all_chats_messages = []
+started_at = time.time()
+
+TOOLS_LOADED.set_function(lambda: len(tools))
+DOCUMENTS_REGISTERED.set_function(lambda: len(all_files))
+INGESTION_JOBS.labels("queued").set_function(lambda: sum(job["status"] == "queued" for job in ingestion_jobs.active()))
+INGESTION_JOBS.labels("running").set_function(lambda: sum(job["status"] == "running" for job in ingestion_jobs.active()))
+CACHE_HIT_RATE.labels("answer").set_function(lambda: answer_cache.stats()["hit_rate"])
+if isinstance(Settings.embed_model, CachedEmbedding):
+    CACHE_HIT_RATE.labels("embedding").set_function(lambda: Settings.embed_model.stats()["hit_rate"])
 
 async def load_tools_in_background():
-    global tools, all_files, all_chats_messages, all_chats
-    all_files = get_all_files()
-    all_chats = get_all_chats()
-    all_chats_messages = get_all_chat_messages()
+    global all_files
+    await document_registry.snapshot()
+    all_files = await run_db(get_all_files)
+    await tool_warmup.run(list(all_files), lambda tool: tools.append(tool))
 
-    for file in all_files:
-        filename = os.path.splitext(file["filename"])[0]
-        description = file['description']
+    while True:
+        await asyncio.sleep(REGISTRY_POLL_SECONDS)
         try:
-            tool = await asyncio.to_thread(load_query_tool, filename, description)
-            tools.append(tool)
-            print(f"Tool loaded for {filename}")
+            await sync_documents()
         except Exception as e:
-            print(f"Failed to load tool for {filename}: {e}")
-
-# ---------------------------- File Routes ----------------------------
+            log(f"Registry sync failed: {e}")
+
+async def sync_documents():
+    """
+    Load, reload or unload the tools of documents changed by other workers.
+
+    Only the changed documents' tools are reloaded. A ChromaDB client never
+    rereads an index another process wrote to and can only be reopened as a
+    whole, so their new vectors need a new client. Reopening it while this
+    worker's own upload or update job is writing through the old one would leave
+    two clients persisting the same files, so the reset waits until no local job
+    is in flight and happens once per sync. Unchanged tools keep querying the
+    previous client, whose indexes of their documents are still current.
+    """
+    global tools, all_files
+    changes = await document_registry.pending_changes()
+    if not changes:
+        return
+
+    all_files = await run_db(get_all_files)
+    files = {os.path.splitext(file["filename"])[0]: file for file in all_files}
+    deleted = set()
+    for filename, action in changes.items():
+        name = os.path.splitext(filename)[0]
+        forget_document(name)
+        if action == "delete" or name not in files:
+            deleted.add(name)
+            tool_warmup.forget(name)
+            log(f"Unloaded tool for {name}")
+
+    while ingestion_jobs.active():
+        await asyncio.sleep(REGISTRY_POLL_SECONDS)
+    reset_vector_client()
+    names = {os.path.splitext(filename)[0] for filename in changes}
+    names = [name for name in names if name in files and name not in deleted]
+    reloaded = await asyncio.gather(*[tool_warmup.load(name, files[name]["description"]) for name in names])
+    fresh = {tool.metadata.name: tool for tool in reloaded if tool is not None}
+    tools = [fresh.pop(tool.metadata.name, tool) for tool in tools if drug_name(tool) not in deleted] + list(fresh.values())
+
+def unavailable_tools_response():
+    """
+    Return (error response or None, note about documents that cannot be consulted).
+
+    Queries are answered from whichever tools are loaded; they are only refused
+    while no tool is ready yet and some are still loading.
+    """
+    missing = tool_warmup.unavailable()
+    if not tools and tool_warmup.pending():
+        return (jsonify({
+            "status": "loading",
+            "message": "Tools are still loading. Please try again shortly."
+        }), 503), None
+    if not missing:
+        return None, None
+    return None, {
+        "missing_documents": missing,
+        "note": f"These documents are not loaded and were not consulted: {', '.join(missing)}"
+    }
+
+@app.before_request
+async def begin_trace():
+    g.trace_id = start_trace(request.headers.get("X-Request-ID"))
+    g.started = time.perf_counter()
+
+@app.after_request
+async def end_trace(response):
+    elapsed = time.perf_counter() - g.started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_SECONDS.labels(request.method, route, str(response.status_code)).observe(elapsed)
+    response.headers["X-Trace-Id"] = g.trace_id
+    # Streamed responses log their summary once the stream ends.
+    if route != "/metrics" and response.mimetype != "text/event-stream":
+        log(f"{request.method} {request.path} {response.status_code} {elapsed * 1000:.1f}ms | {trace_summary()}")
+    return response
+
+async def context_refs(context: list[str]) -> list[dict]:
+    """Store context texts as chunks and return their ids with a short snippet of each."""
+    ids = await run_db(store_context_chunks, context)
+    return [{"id": chunk, "snippet": text[:CONTEXT_SNIPPET_CHARS]} for chunk, text in zip(ids, context)]
+
+def context_mode() -> str | None:
+    """Validate the ?context= query parameter: "full" (default) or "refs"."""
+    mode = request.args.get("context", "full")
+    return mode if mode in ("full", "refs") else None
 
 @app.before_serving
 async def startup():
     asyncio.create_task(load_tools_in_background())
 
+@app.route("/health/live", methods=["GET"])
+async def health_live():
+    return jsonify({"status": "alive", "uptime_seconds": time.time() - started_at})
+
+@app.route("/health/ready", methods=["GET"])
+async def health_ready():
+    report = tool_warmup.report()
+    report["tools_loaded"] = len(tools)
+    return jsonify(report), 200 if report["ready"] else 503
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+# ---------------------------- File Routes ----------------------------
+
 @app.route("/files/<filename>", methods=["GET"])
 async def open_file(filename):
-    global all_files
     for file in all_files:
         if(file['filename'] == filename):
             file_record = file
@@ -61,12 +179,10 @@ async def open_file(filename):
 
 @app.route("/files", methods=["GET"])
 async def list_files():
-    global all_files
     return jsonify({"files": all_files})
 
 @app.route("/upload", methods=["POST"])
 async def upload_pdf():
-    global tools, all_files
     form = await request.files  
 
     if "file" not in form:
@@ -81,19 +197,111 @@ async def upload_pdf():
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
 
+    if await ingestion_jobs.active_anywhere(filename):
+        return jsonify({"error": f"PDF {filename} is already being processed"}), 409
+
+    # Checked in the database rather than all_files, which may not list another worker's upload yet.
+    if await run_db(get_file, filename):
+        return jsonify({"error": f"PDF {filename} is already uploaded; use /update to replace it"}), 409
+
     filepath = os.path.join(folder_path, filename)
     try:
         await file.save(filepath)
-        tool, description = handle_upload(filepath, os.path.splitext(filename)[0])
-        tools.append(tool)
-        insert_pdf_file(filename, filepath, description)
-        all_files = get_all_files()
-        return jsonify({"message": f"PDF {filename} uploaded successfully!"})
     except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    name = os.path.splitext(filename)[0]
+    registered = False
+
+    async def register(result):
+        global all_files
+        nonlocal registered
+        tool, description = result
+        document_registry.applied(await run_db(insert_pdf_file, filename, filepath, description))
+        registered = True
+        tools.append(tool)
+        tool_warmup.set_state(os.path.splitext(filename)[0], "ready")
+        all_files = await run_db(get_all_files)
+
+    def cleanup(error):
+        log(f"Failed to ingest {filename}: {error}")
+        if registered:
+            return
+        # Nothing refers to vectors or nodes indexed for an unregistered file; a retry would index them again.
+        delete_document(name)
         if os.path.exists(filepath):
             os.remove(filepath)
+
+    job_id = ingestion_jobs.submit(
+        filename,
+        lambda progress: handle_upload(filepath, name, progress),
+        on_success=register,
+        on_failure=cleanup
+    )
+    return jsonify({"message": f"PDF {filename} queued for processing", "job_id": job_id}), 202
+
+@app.route("/update", methods=["POST"])
+async def update_pdf():
+    form = await request.files
+
+    if "file" not in form:
+        return jsonify({"error": "No file provided"}), 400
+
+    file = form["file"]
+    filename = file.filename
+
+    file_record = None
+    for f in all_files:
+        if(f['filename'] == filename):
+            file_record = f
+
+    if not file_record:
+        return jsonify({"error": "File not found"}), 404
+
+    if await ingestion_jobs.active_anywhere(filename):
+        return jsonify({"error": f"PDF {filename} is already being processed"}), 409
+
+    filepath = file_record['filepath']
+    new_filepath = f"{filepath}.new"
+    try:
+        await file.save(new_filepath)
+    except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    name = os.path.splitext(filename)[0]
+
+    async def register(result):
+        global tools
+        tool, stats = result
+        if tool is None:
+            os.remove(new_filepath)
+            return stats
+        os.replace(new_filepath, filepath)
+        tools = [t for t in tools if t.metadata.name != tool.metadata.name] + [tool]
+        tool_warmup.set_state(name, "ready")
+        document_registry.applied(await run_db(record_document_change, filename, "update"))
+        return stats
+
+    def cleanup(error):
+        log(f"Failed to update {filename}: {error}")
+        if os.path.exists(new_filepath):
+            os.remove(new_filepath)
+
+    job_id = ingestion_jobs.submit(
+        filename,
+        lambda progress: update_document(new_filepath, filepath, name, progress),
+        on_success=register,
+        on_failure=cleanup
+    )
+    return jsonify({"message": f"PDF {filename} queued for re-indexing", "job_id": job_id}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+async def get_job(job_id):
+    job = await ingestion_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 @app.route("/delete", methods=["DELETE"])
 async def delete_pdf(): 
     global tools, all_files
@@ -113,17 +321,19 @@ async def delete_pdf():
     if not file_record:
         return jsonify({"error": "File not found"}), 404
 
+    if await ingestion_jobs.active_anywhere(filename):
+        return jsonify({"error": f"PDF {filename} is being processed; delete it once the job finishes"}), 409
+
     file_path = file_record['filepath']
     try:
         os.remove(file_path)
-        file_storage_context_path = os.path.join(storage_context_path, os.path.splitext(filename)[0])
-        if os.path.isdir(file_storage_context_path):
-            shutil.rmtree(file_storage_context_path, ignore_errors=True)
-
-        delete_pdf_file(filename)
-        delete_document(os.path.splitext(filename)[0])
-        tools = [tool for tool in tools if tool.metadata.name != os.path.splitext(filename)[0]]
-        all_files = get_all_files()
+
+        document_registry.applied(await run_db(delete_pdf_file, filename))
+        name = os.path.splitext(filename)[0]
+        delete_document(name)
+        tool_warmup.forget(name)
+        tools = [tool for tool in tools if tool.metadata.name != f"drug_{name}"]
+        all_files = await run_db(get_all_files)
         return jsonify({"message": f"PDF {filename} deleted successfully!"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -132,7 +342,6 @@ async def delete_pdf():
 
 @app.route("/query", methods=["GET"])
 async def query_pdf():
-    global tools, all_chats_messages
     query = request.args.get("q")
     if not query:
         return jsonify({"error": "Query is required"}), 400
@@ -140,23 +349,95 @@ async def query_pdf():
     if not id:
         return jsonify({"error": "Chat id is required"}), 400
 
-    if len(tools) < len(all_files):
-        return jsonify({
-            "status": "loading",
-            "message": "Tools are still loading. Please try again shortly."
-        }), 503
+    mode = context_mode()
+    if not mode:
+        return jsonify({"error": "context must be 'full' or 'refs'"}), 400
+
+    error, notice = unavailable_tools_response()
+    if error:
+        return error
     
-    chat_history = []
-    for chat in all_chats_messages:
-        if(chat['chat_id'] == int(id)):
-            conversation = (chat['usermessage'], chat['botmessage'])
-            chat_history.append(conversation)
+    summary, chat_history = await run_db(load_history, int(id))
     try:
-        response, context = await query_document(query, tools, chat_history)
-        return jsonify({"response": response, "context": context})
+        response, context = await query_document(query, tools, chat_history, summary)
+        if mode == "refs":
+            context = await context_refs(context)
+        return jsonify({"response": response, "context": context, **(notice or {})})
     except Exception as e:
         return jsonify({"error": f"An error occurred while generating a response: {str(e)}"}), 500
     
+@app.route("/query/stream", methods=["GET"])
+async def query_pdf_stream():
+    query = request.args.get("q")
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    id = request.args.get("id")
+    if not id:
+        return jsonify({"error": "Chat id is required"}), 400
+
+    mode = context_mode()
+    if not mode:
+        return jsonify({"error": "context must be 'full' or 'refs'"}), 400
+
+    error, notice = unavailable_tools_response()
+    if error:
+        return error
+
+    summary, chat_history = await run_db(load_history, int(id))
+    query_tools = list(tools)
+    started = g.started
+
+    async def send_events():
+        # Quart cancels this generator when the client disconnects, which closes
+        # stream_query_document and cancels the agent run.
+        try:
+            if notice:
+                yield f"event: notice\ndata: {json.dumps(notice)}\n\n"
+            async for event in stream_query_document(query, query_tools, chat_history, summary):
+                if mode == "refs" and "context" in event:
+                    event = {**event, "context": await context_refs(event["context"])}
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            log(f"GET /query/stream done {(time.perf_counter() - started) * 1000:.1f}ms | {trace_summary()}")
+
+    response = Response(send_events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None
+    return response
+
+@app.route("/search", methods=["GET"])
+async def search():
+    """Return the most relevant leaflet passages for q, without generating an answer."""
+    query = request.args.get("q")
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    try:
+        top_n = min(max(int(request.args.get("k", SEARCH_DEFAULT_K)), 1), SEARCH_MAX_K)
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+    route = request.args.get("all", "false").lower() != "true"
+
+    error, notice = unavailable_tools_response()
+    if error:
+        return error
+
+    try:
+        results = await search_documents(query, list(tools), top_n, route)
+    except Exception as e:
+        return jsonify({"error": f"An error occurred while searching: {str(e)}"}), 500
+    return jsonify({"results": results, **(notice or {})})
+
+@app.route("/query/stats", methods=["GET"])
+async def query_stats():
+    total = sum(query_path_counts.values())
+    return jsonify({
+        "paths": dict(query_path_counts),
+        "direct_hit_rate": query_path_counts["direct"] / total if total else 0.0,
+        "answer_cache": answer_cache.stats(),
+        "embedding_cache": Settings.embed_model.stats() if isinstance(Settings.embed_model, CachedEmbedding) else None
+    })
+
 @app.route("/evaluate", methods=["POST"])
 async def evaluate_answer():
     data = await request.get_json()
@@ -173,26 +454,89 @@ async def evaluate_answer():
         return jsonify({"error": "Answer is required"}), 400
 
     try:
-        evaluation = evaluate_sample(question, context, answer, ground_truth)
+        evaluation = await evaluation_runner.evaluate({
+            "question": question,
+            "context": context,
+            "answer": answer,
+            "ground_truth": ground_truth,
+            "documents": [drug_name(tool) for tool in tool_router.exact_matches(question, tools)]
+        })
         return jsonify({"evaluation": evaluation})
     except Exception as e:
         return jsonify({"error": f"An error occurred while generating an evaluation: {str(e)}"}), 500
 
+@app.route("/evaluate/batch", methods=["POST"])
+async def evaluate_batch():
+    data = await request.get_json()
+    chat_id = data.get("chat_id")
+    samples = data.get("samples")
+
+    if chat_id is not None:
+        messages = await run_db(get_chat_messages, int(chat_id), None, None, True)
+        samples = [{
+            "question": m['usermessage'],
+            "context": m['context'],
+            "answer": m['botmessage'],
+            "chat_id": m['chat_id'],
+            "message_id": m['id']
+        } for m in messages]
+    if not isinstance(samples, list) or not samples:
+        return jsonify({"error": "Provide a non-empty list of samples or a chat_id"}), 400
+
+    for i, sample in enumerate(samples):
+        if not sample.get("question") or not sample.get("answer") or not isinstance(sample.get("context"), list):
+            return jsonify({"error": f"Sample {i} needs a question, an answer and a context list"}), 400
+        sample.setdefault("documents", [drug_name(tool) for tool in tool_router.exact_matches(sample["question"], tools)])
+
+    batch_id = evaluation_runner.start(samples)
+    return jsonify({"batch_id": batch_id, "total": len(samples)}), 202
+
+@app.route("/evaluate/batch/<batch_id>", methods=["GET"])
+async def evaluate_batch_status(batch_id):
+    status = evaluation_runner.status(batch_id)
+    if status is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(status)
+
+@app.route("/evaluate/batch/<batch_id>/stream", methods=["GET"])
+async def evaluate_batch_stream(batch_id):
+    if evaluation_runner.status(batch_id) is None:
+        return jsonify({"error": "Batch not found"}), 404
+
+    async def send_events():
+        async for result in evaluation_runner.stream(batch_id):
+            yield f"event: result\ndata: {json.dumps(result, default=str)}\n\n"
+        yield f"event: done\ndata: {json.dumps(evaluation_runner.status(batch_id), default=str)}\n\n"
+
+    response = Response(send_events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None
+    return response
+
+@app.route("/evaluate/report", methods=["GET"])
+async def evaluate_report():
+    group_by = request.args.get("group_by", "document")
+    since = request.args.get("since")
+    until = request.args.get("until")
+    try:
+        report = await run_db(get_evaluation_report, group_by, since, until)
+        return jsonify({"group_by": group_by, "report": report})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
 
 @app.route("/chats", methods=["GET"])
 async def list_chats():
-    global all_chats
-    return jsonify({"chats": all_chats})
+    return jsonify({"chats": await run_db(get_all_chats)})
 
 @app.route("/chats", methods=["POST"])
 async def create_chat():
-    global all_chats
     data = await request.get_json()
     name = data.get("name", "New chat")  
     
     try:
-        chat_id = insert_chat(name)
-        all_chats = get_all_chats()
+        chat_id = await run_db(insert_chat, name)
         return jsonify({
             "message": "Chat created successfully", 
             "chat_id": chat_id,
@@ -203,7 +547,6 @@ async def create_chat():
 
 @app.route("/chats/<int:chat_id>", methods=["PUT"])
 async def update_chat(chat_id):
-    global all_chats
     data = await request.get_json()
     new_name = data.get("name")
     
@@ -211,8 +554,7 @@ async def update_chat(chat_id):
         return jsonify({"error": "New name is required"}), 400
     
     try:
-        updated_name = update_chat_name(chat_id, new_name)
-        all_chats = get_all_chats()
+        updated_name = await run_db(update_chat_name, chat_id, new_name)
         return jsonify({
             "message": "Chat renamed successfully",
             "chat_id": chat_id,
@@ -223,52 +565,70 @@ async def update_chat(chat_id):
 
 @app.route("/chats/<int:chat_id>", methods=["DELETE"])
 async def remove_chat(chat_id):
-    global all_chats
     try:
-        delete_chat(chat_id)
-        all_chats = get_all_chats()
+        await run_db(delete_chat, chat_id)
         return jsonify({"message": f"Chat {chat_id} and its messages deleted successfully"})
     except Exception as e:
         return jsonify({"error": f"Failed to delete chat: {str(e)}"}), 500
 
+def include_context_mode():
+    """Parse ?include_context=: true (texts, default), false, or refs (chunk ids only)."""
+    value = request.args.get("include_context", "true").lower()
+    return "refs" if value == "refs" else value == "true"
+
+@app.route("/chunks", methods=["GET"])
+async def get_chunks():
+    ids = [i for i in request.args.get("ids", "").split(",") if i]
+    if not ids:
+        return jsonify({"error": "ids is required"}), 400
+    return jsonify({"chunks": await run_db(get_context_chunks, ids)})
+
 @app.route("/chats/<int:chat_id>/messages", methods=["GET"])
 async def get_messages(chat_id):
-    messages = []
-    for chat_message in all_chats_messages:
-        if(chat_message['chat_id'] == int(chat_id)):
-            messages.append(chat_message)
-    return jsonify({"messages": messages})
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor", type=int)
+    include_context = include_context_mode()
+    messages = await run_db(get_chat_messages, chat_id, limit, cursor, include_context)
+    next_cursor = messages[-1]['id'] if limit and len(messages) == limit else None
+    return jsonify({"messages": messages, "next_cursor": next_cursor})
 
 @app.route("/chats/messages", methods=["GET"])
 async def get_all_messages():
-    global all_chats_messages
-    return jsonify({"all messages": all_chats_messages})
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor", type=int)
+    include_context = include_context_mode()
+    messages = await run_db(get_all_chat_messages, limit, cursor, include_context)
+    next_cursor = messages[-1]['id'] if limit and len(messages) == limit else None
+    return jsonify({"all messages": messages, "next_cursor": next_cursor})
 
 @app.route("/chats/<int:chat_id>/messages", methods=["POST"])
 async def add_message(chat_id):
-    global all_chats_messages
     data = await request.get_json()
     usermessage = data.get("usermessage")
     botmessage = data.get("botmessage")
     context = data.get("context")
+    context_ids = data.get("context_ids")
 
     if not usermessage or not botmessage:
         return jsonify({"error": "Both usermessage and botmessage are required"}), 400
+    if context is not None and not (isinstance(context, list) and all(isinstance(text, str) for text in context)):
+        return jsonify({"error": "Context must be a list of strings"}), 400
+    if context_ids is not None and not (isinstance(context_ids, list) and all(isinstance(id, str) for id in context_ids)):
+        return jsonify({"error": "Context ids must be a list of chunk ids"}), 400
     try:
-        message_id = insert_chat_message(chat_id, usermessage, botmessage, context)
-        all_chats_messages = get_all_chat_messages()
+        message_id = await run_db(insert_chat_message, chat_id, usermessage, botmessage, context, context_ids)
+        app.add_background_task(update_summary, chat_id)
         return jsonify({"message": "Message added successfully", "id": message_id})
     except Exception as e:
         return jsonify({"error": f"Failed to save message: {str(e)}"}), 500
 
 @app.route("/chats/<int:chat_id>/messages", methods=["DELETE"])
 async def delete_messages(chat_id):
-    global all_chats_messages
     data = await request.get_json()
     message_id = data.get("id")
     try:
-        delete_messages_after(message_id, chat_id)
-        all_chats_messages = get_all_chat_messages()
+        await run_db(reset_chat_summary_after, chat_id, message_id)
+        await run_db(delete_messages_after, message_id, chat_id)
         return jsonify({"message": "Messages successfully deleted"})
     except Exception as e:
         return jsonify({"error": f"Failed to save message: {str(e)}"}), 500
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+Checks of the answer cache against a real SQLite file.
+
+Usage (from the backend directory):
+    python -m benchmarks.cache
+
+Stores answers through AnswerCache.put with persistence on, reopens the cache
+from disk as a restarted server would, and checks which lookups hit, including
+that a question differing only in the drug it names is not served another
+drug's answer. Nothing outside a temporary directory is touched.
+
+Exits with status 1 if any check fails.
+"""
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+
+def check_persistence(path: str) -> list[str]:
+    from answer_cache import AnswerCache
+
+    failures = []
+    cache = AnswerCache(path)
+    cache.put([1.0, 0.0], "Take 200-400 mg every 4-6 hours.", ["Ibuprofen dosage ..."], {"drug_ibuprofen"})
+    reopened = AnswerCache(path)
+    hit = reopened.get([1.0, 0.0], ["drug_ibuprofen", "drug_warfarin"])
+    if not hit or hit["response"] != "Take 200-400 mg every 4-6 hours.":
+        failures.append("a persisted answer was not served after reopening the cache")
+    elif hit["context"] != ["Ibuprofen dosage ..."] or hit["sources"] != {"drug_ibuprofen"}:
+        failures.append("a persisted answer came back with different context or sources")
+    if reopened.get([1.0, 0.0], ["drug_warfarin"]):
+        failures.append("an answer was served although its source tool is not loaded")
+
+    reopened.invalidate("drug_ibuprofen")
+    if AnswerCache(path).get([1.0, 0.0], ["drug_ibuprofen"]):
+        failures.append("an invalidated answer was still on disk")
+    return failures
+
+
+def check_drug_scope(path: str) -> list[str]:
+    from answer_cache import AnswerCache
+    from tool_router import tool_router
+
+    tools = [SimpleNamespace(metadata=SimpleNamespace(name=f"drug_{name}")) for name in ("ibuprofen", "naproxen", "warfarin")]
+    names = [tool.metadata.name for tool in tools]
+
+    def drugs(query: str) -> list[str]:
+        return [tool.metadata.name for tool in tool_router.exact_matches(query, tools)]
+
+    failures = []
+    cache = AnswerCache(path)
+    # Both questions get the same embedding, as near-identical phrasings do.
+    cache.put([1.0, 0.0], "Take 250-500 mg twice daily.", ["Naproxen dosage ..."], {"drug_naproxen"},
+              drugs("max dose of naproxen"))
+    if not AnswerCache(path).get([1.0, 0.0], names, drugs("Max dose of naproxen?")):
+        failures.append("a question naming the same drug missed the cache")
+    if AnswerCache(path).get([1.0, 0.0], names, drugs("max dose of ibuprofen")):
+        failures.append("a question about another drug was served the cached answer")
+    if AnswerCache(path).get([1.0, 0.0], names, drugs("max dose of naproxen with warfarin")):
+        failures.append("a question naming a drug the cached answer did not use was served it")
+    if AnswerCache(path).get([1.0, 0.0], names, drugs("max dose")):
+        failures.append("a question naming no drug was served a drug-specific answer")
+    return failures
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="rag-cache-")
+    failures = check_persistence(os.path.join(workdir, "answer_cache.sqlite3"))
+    failures += check_drug_scope(os.path.join(workdir, "answer_cache_drugs.sqlite3"))
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"answer cache: {'FAILED' if failures else 'ok'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
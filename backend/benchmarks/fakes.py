@@ -0,0 +1,238 @@
+"""
+Deterministic local stand-ins for the OpenAI LLM, the OpenAI embedder, the
+LLMSherpa PDF reader and the cross-encoder, with configurable latencies.
+"""
+import re
+import time
+import asyncio
+import random
+import hashlib
+from typing import Any, List, Sequence
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.base.llms.generic_utils import (
+    completion_response_to_chat_response,
+    astream_completion_response_to_chat_response,
+)
+from llama_index.core.llms import CustomLLM, CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+
+WORDS = (
+    "tablet dose daily adult child kidney liver pregnancy breastfeeding headache nausea dizziness rash "
+    "allergy bleeding stomach ulcer blood pressure heart interaction alcohol overdose storage temperature "
+    "package leaflet doctor pharmacist symptoms treatment infection pain fever inflammation milligram "
+    "hours meal water swallow crush contraindicated elderly caution monitor"
+).split()
+
+TOOL_THOUGHT = "Thought: I need to use a tool."
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class FakeLLM(CustomLLM):
+    """
+    ReAct-speaking LLM that answers deterministically.
+
+    Given a ReAct prompt it first calls the drug tool named in the user question (or
+    the first tool offered) and answers once that call is in the history. Any other
+    prompt gets a plain answer.
+    """
+
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    calls: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake-llm", context_window=128000, num_output=512)
+
+    def _respond(self, prompt: str) -> str:
+        if TOOL_THOUGHT in prompt:
+            return f"Thought: I can answer without using any more tools.\nAnswer: {self._answer(prompt)}"
+        if "Action Input" not in prompt:
+            return self._answer(prompt)
+
+        question = prompt.rsplit("Current user question:", 1)[-1].lower()
+        tools = list(dict.fromkeys(re.findall(r"drug_[\w\-]+", prompt)))
+        if not tools:
+            return f"Thought: I can answer without using any tools.\nAnswer: {self._answer(prompt)}"
+        named = [tool for tool in tools if tool[len("drug_"):].lower().replace("_", " ") in question]
+        tool = (named or tools)[0]
+        query = question.strip().splitlines()[0].replace('"', "") if question.strip() else "information"
+        return f'{TOOL_THOUGHT}\nAction: {tool}\nAction Input: {{"input": "{query}"}}'
+
+    def _answer(self, prompt: str) -> str:
+        rng = random.Random(_seed(prompt))
+        return " ".join(rng.choice(WORDS) for _ in range(40)) + "."
+
+    def _delay(self, text: str) -> float:
+        self.calls += 1
+        delay = self.latency
+        if self.tokens_per_second:
+            delay += len(text.split()) / self.tokens_per_second
+        return delay
+
+    def _wait(self, text: str):
+        time.sleep(self._delay(text))
+
+    async def _await(self, text: str):
+        await asyncio.sleep(self._delay(text))
+
+    @staticmethod
+    def _stream(text: str):
+        emitted = ""
+        for word in text.split(" "):
+            delta = word if not emitted else f" {word}"
+            emitted += delta
+            yield CompletionResponse(text=emitted, delta=delta)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self._respond(prompt)
+        self._wait(text)
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        text = self._respond(prompt)
+        self._wait(text)
+        return self._stream(text)
+
+    async def _acomplete(self, prompt: str) -> CompletionResponse:
+        text = self._respond(prompt)
+        await self._await(text)
+        return CompletionResponse(text=text)
+
+    async def _astream_complete(self, prompt: str):
+        text = self._respond(prompt)
+        await self._await(text)
+
+        async def gen():
+            for chunk in self._stream(text):
+                yield chunk
+        return gen()
+
+    # The chat methods call the undecorated helpers so each request is reported
+    # to llama_index instrumentation as exactly one LLM call.
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await self._acomplete(prompt)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return await self._astream_complete(prompt)
+
+    @llm_chat_callback()
+    async def achat(self, messages, **kwargs: Any):
+        prompt = self.messages_to_prompt(messages)
+        return completion_response_to_chat_response(await self._acomplete(prompt))
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages, **kwargs: Any):
+        prompt = self.messages_to_prompt(messages)
+        return astream_completion_response_to_chat_response(await self._astream_complete(prompt))
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Hashed bag-of-words embedding: similar texts get similar vectors."""
+
+    dimensions: int = 256
+    latency: float = 0.0
+    calls: int = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _vector(self, text: str) -> Embedding:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            vector[_seed(token) % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def _aembed(self, texts: List[str]) -> List[Embedding]:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return (await self._aembed([query]))[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aembed([text]))[0]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._aembed(texts)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+
+class FakeParsedDocument:
+    def __init__(self, text: str):
+        self.text = text
+
+    def to_text(self) -> str:
+        return self.text
+
+
+class FakePDFReader:
+    """Replaces LayoutPDFReader; generates a leaflet-like text seeded by the file name."""
+
+    def __init__(self, latency: float = 0.0, paragraphs: int = 120):
+        self.latency = latency
+        self.paragraphs = paragraphs
+
+    def read_pdf(self, path_or_url: str) -> FakeParsedDocument:
+        if self.latency:
+            time.sleep(self.latency)
+        name = re.sub(r"\.pdf$", "", path_or_url.rsplit("/", 1)[-1], flags=re.IGNORECASE)
+        return FakeParsedDocument(synthetic_leaflet(name, self.paragraphs))
+
+
+def synthetic_leaflet(name: str, paragraphs: int) -> str:
+    rng = random.Random(_seed(name))
+    sections = ["What {n} is", "Dosage of {n}", "Side effects of {n}", "Interactions with {n}", "Storing {n}"]
+    blocks = []
+    for i in range(paragraphs):
+        if i % (paragraphs // len(sections) or 1) == 0:
+            blocks.append(sections[(i * len(sections)) // paragraphs].format(n=name))
+        sentence_count = rng.randint(3, 6)
+        blocks.append(" ".join(
+            f"{name.capitalize()} " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 16))) + "."
+            for _ in range(sentence_count)
+        ))
+    return "\n\n".join(blocks)
+
+
+class FakeCrossEncoder:
+    """Token-overlap scorer with the CrossEncoder.predict signature."""
+
+    def __init__(self, latency_per_pair: float = 0.0):
+        self.latency_per_pair = latency_per_pair
+
+    def predict(self, pairs: Sequence[tuple[str, str]], batch_size: int = 32, show_progress_bar: bool = False):
+        if self.latency_per_pair:
+            time.sleep(self.latency_per_pair * len(pairs))
+        scores = []
+        for query, passage in pairs:
+            query_tokens = set(re.findall(r"\w+", query.lower()))
+            passage_tokens = set(re.findall(r"\w+", passage.lower()))
+            scores.append(len(query_tokens & passage_tokens) / (len(query_tokens) or 1))
+        return np.asarray(scores, dtype=np.float32)
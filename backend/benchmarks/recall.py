@@ -0,0 +1,144 @@
+"""
+recall@k of compact vector search against the current setup.
+
+Usage (from the backend directory, with the server's environment):
+    python -m benchmarks.recall [--k 8] [--samples 50] [--questions questions.txt] [--output recall.json]
+
+For each registered document, its stored leaf vectors are read from Chroma
+and queried per document, the way a drug_<name> tool retrieves. The queries
+are a sample of the document's own leaves (each excluding itself from the
+results) plus, if --questions is given, one embedded question per line. Each
+method's top k is compared with an exact float32 search:
+
+    chroma        the current HNSW index
+    <p>_scan      float16 / int8 vectors alone (first stage only)
+    <p>_rescored  first stage shortlist of COMPACT_RESCORE_FACTOR x k, re-scored
+                  with full-precision vectors (what VECTOR_PRECISION=<p> serves)
+
+Nothing is written to any store.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import statistics
+import numpy as np
+
+
+def load_document(client, name: str):
+    """Return (collection, where, ids, vectors) of a document's vectors in Chroma, or None."""
+    from vector_layout import SHARED_COLLECTION, DOCUMENT_KEY, collection_names
+
+    existing = set(collection_names(client))
+    if name in existing and name != SHARED_COLLECTION:
+        collection, where = client.get_collection(name), None
+    elif SHARED_COLLECTION in existing:
+        collection, where = client.get_collection(SHARED_COLLECTION), {DOCUMENT_KEY: name}
+    else:
+        return None
+    stored = collection.get(where=where, include=["embeddings"])
+    if not stored["ids"]:
+        return None
+    return collection, where, stored["ids"], np.asarray(stored["embeddings"], dtype=np.float32)
+
+
+def recall(found: list, expected: list) -> float:
+    return len(set(found) & set(expected)) / len(expected) if expected else 1.0
+
+
+def evaluate_document(collection, where, ids: list, vectors: np.ndarray, queries: list, k: int, factor: int) -> dict:
+    from compact_vectors import normalize, quantize, approximate_scores, top_k
+
+    unit = normalize(vectors)
+    compact = {precision: quantize(vectors, precision) for precision in ("float16", "int8")}
+    results = {"chroma": []}
+    for precision in compact:
+        results[f"{precision}_scan"] = []
+        results[f"{precision}_rescored"] = []
+
+    for query, exclude in queries:
+        query = normalize(query)
+        wanted = k + (1 if exclude is not None else 0)
+
+        def pick(indices):
+            return [ids[i] for i in indices if ids[i] != exclude][:k]
+
+        exact = pick(top_k(unit @ query, wanted))
+        chroma = collection.query(query_embeddings=[query.tolist()], n_results=min(wanted, len(ids)), where=where)
+        results["chroma"].append(recall([id for id in chroma["ids"][0] if id != exclude][:k], exact))
+
+        for precision, (matrix, scales) in compact.items():
+            scores = approximate_scores(matrix, scales, query)
+            results[f"{precision}_scan"].append(recall(pick(top_k(scores, wanted)), exact))
+            shortlist = top_k(scores, wanted * factor)
+            rescored = shortlist[np.argsort(-(unit[shortlist] @ query))]
+            results[f"{precision}_rescored"].append(recall(pick(rescored), exact))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="recall@k of compact vector search against the current setup.")
+    parser.add_argument("--k", type=int, default=8, help="Results compared per query (the retriever's top k)")
+    parser.add_argument("--samples", type=int, default=50, help="Stored leaves used as queries per document")
+    parser.add_argument("--questions", default=None, help="File with one question per line, embedded as queries")
+    parser.add_argument("--documents", nargs="*", default=None, help="Limit to these documents")
+    parser.add_argument("--rescore-factor", type=int, default=None, help="Defaults to COMPACT_RESCORE_FACTOR")
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from llama_index.core import Settings
+    from compact_vectors import COMPACT_RESCORE_FACTOR
+    from database import init_db, get_all_files
+    import rag
+
+    factor = args.rescore_factor or COMPACT_RESCORE_FACTOR
+    rng = random.Random(args.seed)
+    question_vectors = []
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        question_vectors = Settings.embed_model.get_text_embedding_batch(questions)
+
+    init_db()
+    names = args.documents or [os.path.splitext(file["filename"])[0] for file in get_all_files()]
+    totals, per_document = {}, {}
+    for name in names:
+        loaded = load_document(rag.chroma_client, name)
+        if loaded is None:
+            print(f"{name}: no vectors in Chroma, skipping")
+            continue
+        collection, where, ids, vectors = loaded
+        sample = rng.sample(range(len(ids)), min(args.samples, len(ids)))
+        queries = [(vectors[i], ids[i]) for i in sample]
+        queries += [(np.asarray(q, dtype=np.float32), None) for q in question_vectors]
+        results = evaluate_document(collection, where, ids, vectors, queries, args.k, factor)
+        per_document[name] = {method: statistics.fmean(values) for method, values in results.items()}
+        for method, values in results.items():
+            totals.setdefault(method, []).extend(values)
+
+    if not totals:
+        print("No documents to evaluate")
+        return 1
+
+    dimensions = next(iter(vectors.shape[1:]), 0)
+    summary = {
+        "k": args.k,
+        "rescore_factor": factor,
+        "queries": len(totals["chroma"]),
+        f"recall_at_{args.k}": {method: statistics.fmean(values) for method, values in totals.items()},
+        "bytes_per_vector": {"float32": 4 * dimensions, "float16": 2 * dimensions, "int8": dimensions + 4},
+    }
+    for method, value in summary[f"recall_at_{args.k}"].items():
+        print(f"{method:18s} recall@{args.k} = {value:.4f}")
+    print(f"bytes per vector: {summary['bytes_per_vector']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "documents": per_document}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Offline benchmark suite.
+
+Usage (from the backend directory):
+    python -m benchmarks.run [--documents 20] [--llm-latency-ms 300] [--output results.json]
+                             [--compare previous.json]
+
+Every external dependency is replaced by the deterministic fakes in
+benchmarks/fakes.py, and all state lives in a temporary directory, so runs are
+reproducible and need no network. Results are written as JSON; --compare prints
+the ratio of each timing to a previous run.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import platform
+import statistics
+
+
+def percentiles(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def configure_environment(workdir: str):
+    """Point every storage path at the scratch directory before the app modules are imported."""
+    os.environ.update({
+        "DB_PATH": os.path.join(workdir, "bench.sqlite3"),
+        "CHROMA_DB_PATH": os.path.join(workdir, "chroma"),
+        "STORAGE_CONTEXT_PATH": os.path.join(workdir, "storage"),
+        "FOLDER_PATH": os.path.join(workdir, "pdf_files"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+    })
+    for key, value in {
+        "API_KEY": "sk-offline",
+        "LLM_MODEL_NAME_OPENAI": "gpt-4o-mini",
+        "EVALUATE_MODEL_NAME_OPENAI": "gpt-4o-mini",
+        "EMBEDDING_MODEL_NAME_OPENAI": "text-embedding-3-small",
+        "LLMSHERPA_API_URL": "http://localhost:5010/api/parseDocument?renderFormat=all",
+        "PROMPT": "You are a medical assistant. Answer only from the provided tools.",
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+        "PARSE_CACHE_ENABLED": "false",
+    }.items():
+        os.environ.setdefault(key, value)
+    os.makedirs(os.environ["FOLDER_PATH"], exist_ok=True)
+
+
+def install_fakes(args):
+    from llama_index.core import Settings
+    import rag
+    import reranker
+    from pdf_parser import LLMSherpaParser
+    from benchmarks.fakes import FakeLLM, FakeEmbedding, FakePDFReader, FakeCrossEncoder
+
+    Settings.llm = FakeLLM(latency=args.llm_latency_ms / 1000, tokens_per_second=args.llm_tokens_per_second)
+    Settings.embed_model = FakeEmbedding(latency=args.embed_latency_ms / 1000)
+    rag.pdf_parser = LLMSherpaParser(FakePDFReader(latency=args.parse_latency_ms / 1000, paragraphs=args.paragraphs))
+
+    if not args.real_reranker:
+        reranker.RerankService._load_model = lambda self: FakeCrossEncoder(latency_per_pair=args.rerank_latency_ms / 1000)
+
+
+DRUGS = [
+    "ibuprofen", "paracetamol", "warfarin", "omeprazole", "amoxicillin", "metformin", "atorvastatin",
+    "lisinopril", "amlodipine", "sertraline", "levothyroxine", "simvastatin", "losartan", "aspirin",
+    "clopidogrel", "prednisone", "gabapentin", "tramadol", "diclofenac", "cetirizine",
+]
+
+
+def document_names(count: int) -> list[str]:
+    return [DRUGS[i % len(DRUGS)] + (f"{i // len(DRUGS)}" if i >= len(DRUGS) else "") for i in range(count)]
+
+
+def bench_ingestion(names: list[str]) -> dict:
+    import rag
+    from database import insert_pdf_file
+    from vector_layout import count_document_vectors
+
+    timings = []
+    leaf_counts = []
+    for name in names:
+        filepath = os.path.join(os.environ["FOLDER_PATH"], f"{name}.pdf")
+        open(filepath, "wb").close()
+        start = time.perf_counter()
+        tool, description = rag.handle_upload(filepath, name)
+        timings.append(time.perf_counter() - start)
+        leaf_counts.append(count_document_vectors(rag.chroma_client, name))
+        insert_pdf_file(f"{name}.pdf", filepath, description)
+
+    total = sum(timings)
+    return {
+        "documents": len(names),
+        "documents_per_second": len(names) / total,
+        "leaf_nodes_per_second": sum(leaf_counts) / total,
+        "per_document": percentiles(timings),
+    }
+
+
+def bench_tool_load(names: list[str]) -> tuple[dict, list]:
+    import rag
+
+    timings = []
+    tools = []
+    for name in names:
+        start = time.perf_counter()
+        tools.append(rag.load_query_tool(name, rag.describe_document(name)))
+        timings.append(time.perf_counter() - start)
+    return {"total_s": sum(timings), "per_tool": percentiles(timings)}, tools
+
+
+async def bench_retrieval(tools: list, queries_per_tool: int) -> dict:
+    import rag
+
+    timings = []
+    for tool in tools:
+        name = tool.metadata.name[len("drug_"):]
+        for i in range(queries_per_tool):
+            query = [f"What is the dosage of {name}?", f"Side effects of {name}", f"Can {name} be taken with alcohol?"][i % 3]
+            start = time.perf_counter()
+            await rag.retrieve_context(tool, query)
+            timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+
+async def bench_query(tools: list, names: list[str], concurrency_levels: list[int], requests_per_level: int) -> dict:
+    import api
+    from database import insert_chat
+
+    api.tools = tools
+    api.all_files = api.get_all_files()
+    client = api.app.test_client()
+    chat_id = insert_chat("benchmark")
+
+    results = {}
+    for concurrency in concurrency_levels:
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+        errors = 0
+
+        async def one(i):
+            nonlocal errors
+            name = names[i % len(names)]
+            question = [f"What is the dosage of {name}?", f"Compare {name} and {names[(i + 1) % len(names)]} side effects"][i % 2]
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get("/query", query_string={"q": question, "id": chat_id})
+                timings.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(requests_per_level)])
+        elapsed = time.perf_counter() - start
+        results[str(concurrency)] = {
+            **percentiles(timings),
+            "throughput_rps": requests_per_level / elapsed,
+            "errors": errors,
+        }
+    return results
+
+
+def bench_chat_db(history_sizes: list[int]) -> dict:
+    from database import insert_chat, insert_chat_message, get_chat_history, get_chat_messages
+
+    chat_id = insert_chat("benchmark-history")
+    context = ["Leaflet paragraph " * 40] * 4
+    results = {}
+    inserted = 0
+    for size in history_sizes:
+        insert_timings = []
+        while inserted < size:
+            start = time.perf_counter()
+            insert_chat_message(chat_id, f"question {inserted}", f"answer {inserted}", context)
+            insert_timings.append(time.perf_counter() - start)
+            inserted += 1
+
+        history_timings, page_timings = [], []
+        for _ in range(20):
+            start = time.perf_counter()
+            get_chat_history(chat_id)
+            history_timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            get_chat_messages(chat_id, 50, max(0, inserted - 50), True)
+            page_timings.append(time.perf_counter() - start)
+
+        results[str(size)] = {
+            "insert": percentiles(insert_timings) if insert_timings else None,
+            "history": percentiles(history_timings),
+            "page_of_50": percentiles(page_timings),
+        }
+    return results
+
+
+def compare(current: dict, previous: dict, path: str = ""):
+    for key, value in current.items():
+        if key not in previous:
+            continue
+        if isinstance(value, dict):
+            compare(value, previous[key], f"{path}{key}.")
+        elif key.endswith("_ms") or key.endswith("_s"):
+            if previous[key]:
+                print(f"{path}{key}: {previous[key]:.2f} -> {value:.2f} ({value / previous[key]:.2f}x)")
+
+
+async def main_async(args) -> dict:
+    names = document_names(args.documents)
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        }
+    }
+
+    from database import init_db
+    init_db()
+
+    results["ingestion"] = await asyncio.to_thread(bench_ingestion, names)
+    results["tool_load"], tools = await asyncio.to_thread(bench_tool_load, names)
+    results["retrieval_rerank"] = await bench_retrieval(tools, args.queries_per_tool)
+    results["query"] = await bench_query(tools, names, args.concurrency, args.requests)
+    results["chat_db"] = await asyncio.to_thread(bench_chat_db, args.history_sizes)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the RAG backend.")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=120, help="Paragraphs per synthetic leaflet")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0, help="0 disables per-token delay")
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--parse-latency-ms", type=float, default=500)
+    parser.add_argument("--rerank-latency-ms", type=float, default=0.5, help="Per (query, passage) pair")
+    parser.add_argument("--real-reranker", action="store_true", help="Use the real cross-encoder model")
+    parser.add_argument("--queries-per-tool", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+        configure_environment(workdir)
+        install_fakes(args)
+        results = asyncio.run(main_async(args))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Two-process check that document changes made by one worker are served by another.
+
+Usage (from the backend directory):
+    python -m benchmarks.workers [--layout per_document|shared] [--precision float32|int8]
+
+Runs with the offline fakes in a temporary directory. This process plays a
+serving worker: it ingests two documents, loads their tools and queries them.
+A second process, started from this module, then plays another worker and
+re-indexes one document, deletes another and adds a new one, logging each
+change in the document registry. After one registry sync this worker must
+retrieve only the re-indexed document's current nodes, must have dropped the
+deleted document's tool, must answer from the added document, and must still
+answer from a document nobody changed, whose tool the sync leaves alone.
+
+Exits with status 1 if any check fails.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+UPDATED, DELETED, ADDED, UNCHANGED = "warfarin", "ibuprofen", "omeprazole", "metformin"
+
+
+def fake_args(paragraphs: int) -> argparse.Namespace:
+    return argparse.Namespace(
+        llm_latency_ms=0, llm_tokens_per_second=0, embed_latency_ms=0, parse_latency_ms=0,
+        paragraphs=paragraphs, rerank_latency_ms=0, real_reranker=False
+    )
+
+
+def other_worker():
+    """Change every document the way another worker's /update, /delete and /upload would."""
+    from benchmarks.run import install_fakes
+    import rag
+    from database import insert_pdf_file, delete_pdf_file, record_document_change
+
+    # The fake reader seeds its text with the file name, so the .new file parses as a new version.
+    install_fakes(fake_args(paragraphs=40))
+    filepath = os.path.join(os.environ["FOLDER_PATH"], f"{UPDATED}.pdf")
+    new_filepath = f"{filepath}.new"
+    with open(new_filepath, "wb") as f:
+        f.write(b"version 2")
+    rag.update_document(new_filepath, filepath, UPDATED)
+    os.replace(new_filepath, filepath)
+    record_document_change(f"{UPDATED}.pdf", "update")
+
+    delete_pdf_file(f"{DELETED}.pdf")
+    rag.delete_document(DELETED)
+
+    filepath = os.path.join(os.environ["FOLDER_PATH"], f"{ADDED}.pdf")
+    open(filepath, "wb").close()
+    _, description = rag.handle_upload(filepath, ADDED)
+    insert_pdf_file(f"{ADDED}.pdf", filepath, description)
+
+    nodes = rag.load_storage_context(UPDATED, rag.document_vector_store(rag.chroma_client, UPDATED)).docstore.docs
+    print(json.dumps(sorted(nodes)))
+
+
+async def serving_worker() -> list[str]:
+    from benchmarks.run import install_fakes, bench_ingestion
+    from llama_index.core.schema import QueryBundle
+    import api
+
+    install_fakes(fake_args(paragraphs=40))
+    bench_ingestion([UPDATED, DELETED, UNCHANGED])
+    await api.document_registry.snapshot()
+    api.all_files = api.get_all_files()
+    for file in api.all_files:
+        tool = await api.tool_warmup.load(os.path.splitext(file["filename"])[0], file["description"])
+        api.tools.append(tool)
+
+    def retrieve(name: str):
+        tool = next((tool for tool in api.tools if tool.metadata.name == f"drug_{name}"), None)
+        return tool and tool.query_engine.retriever.retrieve(QueryBundle(f"{name} dosage side effects"))
+
+    retrieve(UPDATED)
+    unchanged = next(tool for tool in api.tools if tool.metadata.name == f"drug_{UNCHANGED}")
+    changed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.workers", "--other-worker"], capture_output=True, text=True
+    )
+    if changed.returncode:
+        print(changed.stderr)
+        return ["the other worker failed"]
+    current = set(json.loads(changed.stdout.strip().splitlines()[-1]))
+
+    await api.sync_documents()
+
+    failures = []
+    nodes = retrieve(UPDATED)
+    if not nodes:
+        failures.append(f"{UPDATED}: nothing retrieved after the update")
+    elif {node.node.node_id for node in nodes} - current:
+        failures.append(f"{UPDATED}: retrieved nodes the other worker removed")
+    if retrieve(DELETED) is not None:
+        failures.append(f"{DELETED}: tool still loaded after the delete")
+    nodes = retrieve(ADDED)
+    if not nodes:
+        failures.append(f"{ADDED}: nothing retrieved after the upload")
+    elif not all(ADDED.capitalize() in node.node.text for node in nodes):
+        failures.append(f"{ADDED}: retrieved another document's text")
+    if next(tool for tool in api.tools if tool.metadata.name == f"drug_{UNCHANGED}") is not unchanged:
+        failures.append(f"{UNCHANGED}: tool reloaded although the document did not change")
+    nodes = retrieve(UNCHANGED)
+    if not nodes or not all(UNCHANGED.capitalize() in node.node.text for node in nodes):
+        failures.append(f"{UNCHANGED}: not answered from its own text after the sync")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that one worker's document changes reach another worker.")
+    parser.add_argument("--layout", default="per_document", choices=["per_document", "shared"])
+    parser.add_argument("--precision", default="float32", choices=["float32", "float16", "int8"])
+    parser.add_argument("--other-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.other_worker:
+        other_worker()
+        return 0
+
+    from benchmarks.run import configure_environment
+
+    configure_environment(tempfile.mkdtemp(prefix="rag-workers-"))
+    os.environ.update({"VECTOR_LAYOUT": args.layout, "VECTOR_PRECISION": args.precision})
+
+    failures = asyncio.run(serving_worker())
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{args.layout}/{args.precision}: {'FAILED' if failures else 'ok'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
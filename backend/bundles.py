@@ -0,0 +1,319 @@
+"""
+Portable, prebuilt index bundles.
+
+Usage:
+    python bundles.py export <directory> [--documents NAME ...]
+    python bundles.py import <directory or .ragbundle files> [--force] [--no-verify]
+
+A bundle holds everything one document needs to be served: its leaf vectors,
+its docstore nodes, its pdf_files row and the PDF itself, so a new server can
+attach documents without parsing or embedding anything. Export writes one
+<name>.ragbundle per document plus an index.json listing each bundle's sha256.
+Bundles are deterministic, so an unchanged document exports to an identical
+file and file-syncing tools only transfer the bundles that changed. Import
+skips bundles whose sha256 matches the one the document was last imported
+from, and running servers pick up imported documents through the registry.
+
+File layout (format version BUNDLE_FORMAT):
+
+    MAGIC | uint32 format | uint32 header length | header JSON | padding to 64 bytes | sections
+
+The header lists each section's offset (relative to the end of the padding),
+length and sha256. The "embeddings" section is a raw little-endian float32
+matrix that is memory-mapped on import; "vectors" (ids, texts, metadata),
+"docstore" and "pdf" follow it.
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from dotenv import load_dotenv
+from rag import chroma_client, forget_document
+from utils import file_hash
+from docstore import load_storage_context, persist_storage_context
+from vector_layout import document_vector_store, add_document_vectors, read_document_vectors, delete_document_vectors
+from database import init_db, get_all_files, upsert_pdf_file, get_imported_bundles
+
+load_dotenv()
+
+FOLDER_PATH = os.getenv("FOLDER_PATH")
+MAGIC = b"RAGBUNDL"
+BUNDLE_FORMAT = 1
+BUNDLE_SUFFIX = ".ragbundle"
+ALIGN = 64
+IMPORT_BATCH_SIZE = 1000
+
+
+class BundleError(Exception):
+    pass
+
+
+def _json_bytes(value) -> bytes:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def embedding_model_name() -> str:
+    return getattr(Settings.embed_model, "model_name", None) or type(Settings.embed_model).__name__
+
+
+def write_bundle(path: str, file: dict) -> dict:
+    """
+    Pack one registered document into a bundle at path.
+
+    Args:
+        path (str): Bundle file to write.
+        file (dict): The document's pdf_files row.
+
+    Returns:
+        dict: The bundle header.
+    """
+    name = os.path.splitext(file["filename"])[0]
+    rows = {}
+    for batch in read_document_vectors(chroma_client, name):
+        for id, embedding, text, metadata in zip(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]):
+            rows[id] = (embedding, text, metadata)
+    if not rows:
+        raise BundleError(f"{name} has no stored vectors")
+    ids = sorted(rows)
+    embeddings = np.asarray([rows[id][0] for id in ids], dtype="<f4")
+
+    storage_context = load_storage_context(name, document_vector_store(chroma_client, name))
+    nodes = storage_context.docstore.docs
+    sections = {
+        "embeddings": embeddings.tobytes(),
+        "vectors": _json_bytes({"ids": ids, "texts": [rows[id][1] for id in ids], "metadatas": [rows[id][2] for id in ids]}),
+        "docstore": _json_bytes([doc_to_json(nodes[node_id]) for node_id in sorted(nodes)]),
+    }
+    if file["filepath"] and os.path.exists(file["filepath"]):
+        with open(file["filepath"], "rb") as f:
+            sections["pdf"] = f.read()
+
+    header = {
+        "format": BUNDLE_FORMAT,
+        "document": name,
+        "filename": file["filename"],
+        "description": file["description"],
+        "embedding_model": embedding_model_name(),
+        "count": len(ids),
+        "dimensions": int(embeddings.shape[1]),
+        "sections": {},
+    }
+    offset = 0
+    for section, data in sections.items():
+        header["sections"][section] = {"offset": offset, "length": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+        offset += len(data)
+
+    header_bytes = _json_bytes(header)
+    prefix = MAGIC + struct.pack("<II", BUNDLE_FORMAT, len(header_bytes)) + header_bytes
+    padding = b"\0" * (-len(prefix) % ALIGN)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(prefix + padding)
+        for data in sections.values():
+            f.write(data)
+    os.replace(tmp_path, path)
+    return header
+
+
+class Bundle:
+    """A bundle file opened read-only and memory-mapped."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise BundleError(f"{path} is not an index bundle")
+            version, header_length = struct.unpack_from("<II", self._map, len(MAGIC))
+            if version != BUNDLE_FORMAT:
+                raise BundleError(f"{path} has bundle format {version}, this server reads {BUNDLE_FORMAT}")
+            start = len(MAGIC) + 8
+            self.header = json.loads(self._map[start:start + header_length])
+            self.data_start = start + header_length + (-(start + header_length) % ALIGN)
+        except Exception:
+            self.close()
+            raise
+
+    def section(self, name: str) -> bytes | None:
+        info = self.header["sections"].get(name)
+        if info is None:
+            return None
+        start = self.data_start + info["offset"]
+        return self._map[start:start + info["length"]]
+
+    def verify(self):
+        """Check every section against the checksum recorded in the header."""
+        for name, info in self.header["sections"].items():
+            if hashlib.sha256(self.section(name)).hexdigest() != info["sha256"]:
+                raise BundleError(f"section '{name}' is corrupt")
+
+    def embeddings(self) -> np.ndarray:
+        """The float32 embedding matrix, memory-mapped rather than read."""
+        info = self.header["sections"]["embeddings"]
+        return np.memmap(
+            self.path, dtype="<f4", mode="r", offset=self.data_start + info["offset"],
+            shape=(self.header["count"], self.header["dimensions"])
+        )
+
+    def json_section(self, name: str):
+        return json.loads(self.section(name))
+
+    def close(self):
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+def import_bundle(path: str, sha256: str, verify: bool = True, force: bool = False) -> dict:
+    """
+    Attach the document in a bundle to this server's stores and register it.
+
+    Any vectors and docstore nodes the document already had are replaced.
+
+    Args:
+        path (str): Bundle file.
+        sha256 (str): Checksum of the whole file, recorded with the document.
+        verify (bool): Check section checksums before importing.
+        force (bool): Import even if the bundle was built with a different embedding model.
+
+    Returns:
+        dict: The bundle header.
+    """
+    bundle = Bundle(path)
+    try:
+        header = bundle.header
+        name = header["document"]
+        if verify:
+            bundle.verify()
+        if header["embedding_model"] != embedding_model_name() and not force:
+            raise BundleError(
+                f"{path} was built with {header['embedding_model']}, this server embeds queries with "
+                f"{embedding_model_name()} (use --force to import anyway)"
+            )
+
+        delete_document_vectors(chroma_client, name)
+        embeddings = bundle.embeddings()
+        vectors = bundle.json_section("vectors")
+        for start in range(0, header["count"], IMPORT_BATCH_SIZE):
+            stop = start + IMPORT_BATCH_SIZE
+            add_document_vectors(
+                chroma_client, name, vectors["ids"][start:stop], np.asarray(embeddings[start:stop]).tolist(),
+                vectors["texts"][start:stop], vectors["metadatas"][start:stop]
+            )
+
+        storage_context = load_storage_context(name, document_vector_store(chroma_client, name), create=True)
+        storage_context.docstore.add_documents([json_to_doc(node) for node in bundle.json_section("docstore")])
+        persist_storage_context(name, storage_context)
+
+        filepath = os.path.join(FOLDER_PATH, header["filename"])
+        pdf = bundle.section("pdf")
+        if pdf is not None:
+            os.makedirs(FOLDER_PATH, exist_ok=True)
+            tmp_path = f"{filepath}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pdf)
+            os.replace(tmp_path, filepath)
+
+        forget_document(name)
+        upsert_pdf_file(header["filename"], filepath, header["description"], sha256)
+        return header
+    finally:
+        bundle.close()
+
+
+def export_bundles(directory: str, names: list[str] | None = None):
+    init_db()
+    os.makedirs(directory, exist_ok=True)
+    index_path = os.path.join(directory, "index.json")
+    index = {"format": BUNDLE_FORMAT, "bundles": {}}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index["bundles"] = json.load(f).get("bundles", {})
+
+    for file in get_all_files():
+        name = os.path.splitext(file["filename"])[0]
+        if names and name not in names:
+            continue
+        path = os.path.join(directory, f"{name}{BUNDLE_SUFFIX}")
+        previous = index["bundles"].get(name, {}).get("sha256")
+        try:
+            write_bundle(path, file)
+        except Exception as e:
+            print(f"{name}: export failed: {e}")
+            continue
+        sha256 = file_hash(path)
+        index["bundles"][name] = {"file": os.path.basename(path), "sha256": sha256, "size": os.path.getsize(path)}
+        print(f"{name}: {'unchanged' if sha256 == previous else 'exported'} ({sha256[:12]})")
+
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+
+def import_bundles(paths: list[str], verify: bool = True, force: bool = False) -> int:
+    init_db()
+    bundles = []
+    for path in paths:
+        if not os.path.isdir(path):
+            bundles.append((path, None))
+            continue
+        index_path = os.path.join(path, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                entries = json.load(f)["bundles"].values()
+            bundles.extend((os.path.join(path, entry["file"]), entry["sha256"]) for entry in entries)
+        else:
+            bundles.extend((os.path.join(path, f), None) for f in sorted(os.listdir(path)) if f.endswith(BUNDLE_SUFFIX))
+
+    imported = get_imported_bundles()
+    registered = {file["filename"] for file in get_all_files()}
+    failures = 0
+    for path, listed_sha256 in bundles:
+        sha256 = file_hash(path)
+        if listed_sha256 and sha256 != listed_sha256:
+            print(f"{path}: checksum does not match index.json, skipping")
+            failures += 1
+            continue
+        filename = next((f for f, h in imported.items() if h == sha256), None)
+        if filename in registered and not force:
+            print(f"{os.path.basename(path)}: unchanged, skipping")
+            continue
+        try:
+            header = import_bundle(path, sha256, verify, force)
+        except Exception as e:
+            print(f"{path}: import failed: {e}")
+            failures += 1
+            continue
+        print(f"{header['document']}: imported {header['count']} vectors")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and import portable index bundles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write a bundle per registered document")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--documents", nargs="*", default=None, help="Only export these documents")
+    import_parser = commands.add_parser("import", help="Attach documents from bundles")
+    import_parser.add_argument("paths", nargs="+", help="Bundle files or directories of bundles")
+    import_parser.add_argument("--force", action="store_true", help="Re-import unchanged bundles and ignore model mismatches")
+    import_parser.add_argument("--no-verify", action="store_true", help="Skip section checksums")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_bundles(args.directory, args.documents)
+        return 0
+    return 1 if import_bundles(args.paths, not args.no_verify, args.force) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+import os
+import json
+import threading
+from typing import Any, List, Optional, Sequence
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+from dotenv import load_dotenv
+from sqlite_pool import ConnectionPool
+from metrics import span
+
+load_dotenv()
+
+VECTOR_PRECISION = os.getenv("VECTOR_PRECISION", "float32").lower()
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH")
+COMPACT_VECTOR_PATH = os.getenv("COMPACT_VECTOR_PATH") or os.path.join(CHROMA_DB_PATH or ".", "compact_vectors.sqlite3")
+COMPACT_RESCORE_FACTOR = int(os.getenv("COMPACT_RESCORE_FACTOR", "4"))
+DOCUMENT_KEY = "document"
+PRECISIONS = ("float16", "int8")
+SCORE_BLOCK_ROWS = 65536
+
+
+def compact_mode() -> bool:
+    return VECTOR_PRECISION in PRECISIONS
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(vectors: np.ndarray, precision: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compress unit-normalized vectors for first-stage search.
+
+    float16 halves the size. int8 quarters it, with one symmetric scale per vector
+    so every vector uses the full [-127, 127] range.
+
+    Returns:
+        tuple: (compact matrix, per-vector scales; all ones for float16)
+    """
+    vectors = normalize(vectors)
+    if precision == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    if precision == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown VECTOR_PRECISION '{precision}', expected one of {PRECISIONS}")
+
+
+def approximate_scores(compact: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Cosine similarity of a unit query to every compact vector, computed in blocks to bound memory."""
+    scores = np.empty(len(compact), dtype=np.float32)
+    for start in range(0, len(compact), SCORE_BLOCK_ROWS):
+        block = compact[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+        scores[start:start + SCORE_BLOCK_ROWS] = (block @ query) * scales[start:start + SCORE_BLOCK_ROWS]
+    return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class _Matrix:
+    def __init__(self, ids: list[str], documents: list[str], compact: np.ndarray, scales: np.ndarray):
+        self.ids = ids
+        self.documents = np.asarray(documents, dtype=object)
+        self.compact = compact
+        self.scales = scales
+
+
+class CompactVectorIndex:
+    """
+    SQLite-backed vectors with a compact in-memory copy for search.
+
+    Each collection's float16 or int8 vectors are loaded into RAM on first use and
+    scanned exhaustively; the full-precision float32 vectors stay on disk and are
+    read only for the shortlist of COMPACT_RESCORE_FACTOR x k candidates, which
+    are re-scored exactly. Node text and metadata are read only for the final k.
+    """
+
+    def __init__(self, path: str = COMPACT_VECTOR_PATH, precision: str = VECTOR_PRECISION):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown VECTOR_PRECISION '{precision}', expected one of {PRECISIONS}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.precision = precision
+        self.pool = ConnectionPool(path, size=1, stage="vectors")
+        self._matrices = {}
+        self._lock = threading.Lock()
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS compact_vectors (
+                    collection TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    document TEXT,
+                    ref_doc_id TEXT,
+                    compact BLOB NOT NULL,
+                    scale REAL NOT NULL,
+                    PRIMARY KEY (collection, id)
+                );
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS full_vectors (
+                    collection TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    text TEXT,
+                    metadata TEXT NOT NULL,
+                    PRIMARY KEY (collection, id)
+                );
+            """)
+
+    def evict(self, collection: str | None = None):
+        """Drop cached matrices so they are reloaded from disk, e.g. after another process wrote."""
+        with self._lock:
+            if collection is None:
+                self._matrices.clear()
+            else:
+                self._matrices.pop(collection, None)
+
+    def upsert(self, collection: str, ids: list[str], embeddings: list, texts: list, metadatas: list[dict]):
+        """Store vectors with their node text and Chroma-style metadata (including _node_content)."""
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        compact, scales = quantize(vectors, self.precision)
+        with self.pool.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO compact_vectors (collection, id, document, ref_doc_id, compact, scale) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (collection, id, metadata.get(DOCUMENT_KEY), metadata.get("ref_doc_id"), row.tobytes(), float(scale))
+                    for id, metadata, row, scale in zip(ids, metadatas, compact, scales)
+                ]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO full_vectors (collection, id, vector, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (collection, id, vector.tobytes(), text, json.dumps(metadata))
+                    for id, vector, text, metadata in zip(ids, vectors, texts, metadatas)
+                ]
+            )
+        self.evict(collection)
+
+    def delete(self, collection: str, ids: list[str] | None = None, document: str | None = None,
+               ref_doc_id: str | None = None):
+        """Delete the given ids, or every vector of a document or ref doc, or the whole collection."""
+        conditions, params = ["collection = ?"], [collection]
+        if ids is not None:
+            conditions.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        if document is not None:
+            conditions.append("document = ?")
+            params.append(document)
+        if ref_doc_id is not None:
+            conditions.append("ref_doc_id = ?")
+            params.append(ref_doc_id)
+        where = " AND ".join(conditions)
+        with self.pool.transaction() as conn:
+            conn.execute(
+                f"DELETE FROM full_vectors WHERE collection = ? AND id IN (SELECT id FROM compact_vectors WHERE {where})",
+                [collection, *params]
+            )
+            conn.execute(f"DELETE FROM compact_vectors WHERE {where}", params)
+        self.evict(collection)
+
+    def count(self, collection: str, document: str | None = None) -> int:
+        if document is None:
+            return self.pool.fetchone("SELECT COUNT(*) FROM compact_vectors WHERE collection = ?", (collection,))[0]
+        return self.pool.fetchone(
+            "SELECT COUNT(*) FROM compact_vectors WHERE collection = ? AND document = ?", (collection, document)
+        )[0]
+
+    def get(self, collection: str, document: str | None = None, limit: int | None = None, offset: int = 0) -> dict:
+        """Return stored rows in id order, shaped like Chroma's get (ids, embeddings, documents, metadatas)."""
+        query = (
+            "SELECT f.id, f.vector, f.text, f.metadata FROM full_vectors f "
+            "JOIN compact_vectors c ON c.collection = f.collection AND c.id = f.id WHERE f.collection = ?"
+        )
+        params = [collection]
+        if document is not None:
+            query += " AND c.document = ?"
+            params.append(document)
+        query += " ORDER BY f.id LIMIT ? OFFSET ?"
+        rows = self.pool.fetchall(query, (*params, -1 if limit is None else limit, offset))
+        return {
+            "ids": [row[0] for row in rows],
+            "embeddings": [np.frombuffer(row[1], dtype=np.float32) for row in rows],
+            "documents": [row[2] for row in rows],
+            "metadatas": [json.loads(row[3]) for row in rows],
+        }
+
+    def full_vectors(self, collection: str, ids: list[str]) -> dict:
+        """Return {id: float32 vector} for the ids that exist."""
+        vectors = {}
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            rows = self.pool.fetchall(
+                f"SELECT id, vector FROM full_vectors WHERE collection = ? AND id IN ({','.join('?' * len(batch))})",
+                (collection, *batch)
+            )
+            vectors.update({id: np.frombuffer(vector, dtype=np.float32) for id, vector in rows})
+        return vectors
+
+    def _matrix(self, collection: str) -> _Matrix:
+        with self._lock:
+            matrix = self._matrices.get(collection)
+        if matrix is not None:
+            return matrix
+
+        rows = self.pool.fetchall(
+            "SELECT id, document, compact, scale FROM compact_vectors WHERE collection = ?", (collection,)
+        )
+        dtype = np.float16 if self.precision == "float16" else np.int8
+        compact = np.stack([np.frombuffer(row[2], dtype=dtype) for row in rows]) if rows else np.empty((0, 0), dtype)
+        matrix = _Matrix(
+            [row[0] for row in rows], [row[1] for row in rows], compact,
+            np.asarray([row[3] for row in rows], dtype=np.float32)
+        )
+        with self._lock:
+            self._matrices[collection] = matrix
+        return matrix
+
+    def search(self, collection: str, embedding: list, k: int, documents: set | None = None) -> list[tuple[str, float]]:
+        """
+        Return the k most similar (id, cosine similarity) pairs, best first.
+
+        Args:
+            collection (str): Collection to search.
+            embedding (list): Query embedding.
+            k (int): Results wanted.
+            documents (set, optional): Only consider vectors tagged with these documents.
+        """
+        matrix = self._matrix(collection)
+        if not matrix.ids or k <= 0:
+            return []
+        query = normalize(embedding)
+        with span("compact_scan"):
+            scores = approximate_scores(matrix.compact, matrix.scales, query)
+            if documents is not None:
+                scores[~np.isin(matrix.documents, list(documents))] = -np.inf
+            shortlist = [i for i in top_k(scores, k * max(1, COMPACT_RESCORE_FACTOR)) if np.isfinite(scores[i])]
+
+        with span("compact_rescore"):
+            ids = [matrix.ids[i] for i in shortlist]
+            full = self.full_vectors(collection, ids)
+            ids = [id for id in ids if id in full]
+            if not ids:
+                return []
+            exact = normalize(np.stack([full[id] for id in ids])) @ query
+        return [(ids[i], float(exact[i])) for i in top_k(exact, k)]
+
+    def nodes(self, collection: str, ids: list[str]) -> dict:
+        """Return {id: node} rebuilt from the stored text and metadata."""
+        if not ids:
+            return {}
+        rows = self.pool.fetchall(
+            f"SELECT id, text, metadata FROM full_vectors WHERE collection = ? AND id IN ({','.join('?' * len(ids))})",
+            (collection, *ids)
+        )
+        return {id: metadata_dict_to_node(json.loads(metadata), text=text) for id, text, metadata in rows}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def shared_compact_index() -> CompactVectorIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CompactVectorIndex()
+        return _index
+
+
+def evict_compact_vectors(collection: str | None = None):
+    """Forget this process's compact matrices of a collection (or all) so they are re-read from disk."""
+    if _index is not None:
+        _index.evict(collection)
+
+
+def _filter_documents(filters: MetadataFilters | None) -> set | None:
+    if filters is None or not filters.filters:
+        return None
+    documents = None
+    for condition in filters.filters:
+        if getattr(condition, "key", None) != DOCUMENT_KEY:
+            raise ValueError(f"Compact vector store can only filter on '{DOCUMENT_KEY}'")
+        if condition.operator == FilterOperator.EQ:
+            values = {condition.value}
+        elif condition.operator == FilterOperator.IN:
+            values = set(condition.value)
+        else:
+            raise ValueError(f"Unsupported filter operator {condition.operator} on '{DOCUMENT_KEY}'")
+        documents = values if documents is None else documents & values
+    return documents
+
+
+class CompactVectorStore(BasePydanticVectorStore):
+    """llama_index vector store view of one collection of the shared CompactVectorIndex."""
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+    collection: str
+
+    _index: Any = PrivateAttr()
+
+    def __init__(self, collection: str, index: CompactVectorIndex | None = None, **kwargs: Any):
+        super().__init__(collection=collection, **kwargs)
+        self._index = index or shared_compact_index()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CompactVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return self._index
+
+    def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+        ids = [node.node_id for node in nodes]
+        self._index.upsert(
+            self.collection,
+            ids,
+            [node.get_embedding() for node in nodes],
+            [node.get_content() for node in nodes],
+            [node_to_metadata_dict(node, remove_text=True, flat_metadata=False) for node in nodes]
+        )
+        return ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._index.delete(self.collection, ref_doc_id=ref_doc_id)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None,
+                     **delete_kwargs: Any) -> None:
+        documents = _filter_documents(filters)
+        if documents is None:
+            self._index.delete(self.collection, ids=node_ids or [])
+            return
+        for document in documents:
+            self._index.delete(self.collection, ids=node_ids, document=document)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.query_embedding is None:
+            raise ValueError("Compact vector store needs a query embedding")
+        hits = self._index.search(
+            self.collection, query.query_embedding, query.similarity_top_k, _filter_documents(query.filters)
+        )
+        nodes = self._index.nodes(self.collection, [id for id, _ in hits])
+        hits = [(id, score) for id, score in hits if id in nodes]
+        return VectorStoreQueryResult(
+            nodes=[nodes[id] for id, _ in hits],
+            similarities=[score for _, score in hits],
+            ids=[id for id, _ in hits]
+        )
@@ -0,0 +1,87 @@
+import os
+import asyncio
+from collections import defaultdict
+from llama_index.core import Settings
+from llama_index.core.utils import get_tokenizer
+from dotenv import load_dotenv
+from database import run_db, get_chat_summary, get_chat_messages, upsert_chat_summary
+
+load_dotenv()
+
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "4"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and a medical assistant.
+Update the summary with the new turns below. Keep drug names, doses, conditions, allergies and any
+facts the user stated about themselves. Be concise and write plain prose.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+_locks = defaultdict(asyncio.Lock)
+
+
+def format_turns(turns) -> str:
+    return "\n".join([f"User: {user}\nAssistant: {assistant}" for user, assistant in turns])
+
+
+def load_history(chat_id) -> tuple[str, list[tuple[str, str]]]:
+    """
+    Return the chat's running summary and the turns it does not cover yet.
+
+    Returns:
+        tuple: (summary text, list of (usermessage, botmessage) turns after the summary)
+    """
+    summary, summarized_until = get_chat_summary(chat_id)
+    messages = get_chat_messages(chat_id, cursor=summarized_until)
+    return summary, [(m['usermessage'], m['botmessage']) for m in messages]
+
+
+def format_history(summary: str, turns: list[tuple[str, str]], token_budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """
+    Render the history section of a prompt within a token budget.
+
+    The summary is kept first; the most recent turns are then added verbatim,
+    newest first, until the budget is used up.
+    """
+    tokenizer = get_tokenizer()
+    parts = []
+    used = 0
+    if summary:
+        summary_text = f"Summary of earlier conversation: {summary}"
+        used = len(tokenizer(summary_text))
+        parts.append(summary_text)
+
+    recent = []
+    for turn in reversed(turns):
+        text = format_turns([turn])
+        cost = len(tokenizer(text))
+        if used + cost > token_budget and recent:
+            break
+        recent.append(text)
+        used += cost
+    return "\n".join(parts + list(reversed(recent)))
+
+
+async def update_summary(chat_id):
+    """
+    Fold turns older than the last HISTORY_RECENT_TURNS into the chat's stored summary.
+
+    Only the turns added since the previous update are sent to the LLM, so the
+    summary is extended incrementally rather than rebuilt.
+    """
+    async with _locks[chat_id]:
+        summary, summarized_until = await run_db(get_chat_summary, chat_id)
+        pending = await run_db(get_chat_messages, chat_id, None, summarized_until)
+        fold = pending[:-HISTORY_RECENT_TURNS] if HISTORY_RECENT_TURNS else pending
+        if not fold:
+            return
+
+        turns = format_turns([(m['usermessage'], m['botmessage']) for m in fold])
+        response = await Settings.llm.acomplete(SUMMARY_PROMPT.format(summary=summary or "(empty)", turns=turns))
+        await run_db(upsert_chat_summary, chat_id, response.text.strip(), fold[-1]['id'])
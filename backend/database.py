@@ -1,7 +1,9 @@
-import sqlite3
 import os
 import json
+import time
+import hashlib
 from dotenv import load_dotenv
+from sqlite_pool import ConnectionPool
 
 load_dotenv()
 db_path = os.getenv("DB_PATH")
@@ -12,27 +14,32 @@ class DatabaseSingleton:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(DatabaseSingleton, cls).__new__(cls)
-            cls._instance.conn = sqlite3.connect(db_path, check_same_thread=False)
-            cls._instance.conn.execute("PRAGMA foreign_keys = ON;")  
-            cls._instance.cursor = cls._instance.conn.cursor()
+            cls._instance.pool = ConnectionPool(db_path)
         return cls._instance
 
     def execute(self, query, params=()):
-        self.cursor.execute(query, params)
-        self.conn.commit()
+        return self.pool.execute(query, params)
+
+    def executemany(self, query, seq_of_params):
+        self.pool.executemany(query, seq_of_params)
+
+    def transaction(self):
+        return self.pool.transaction()
 
     def fetchall(self, query, params=()):
-        self.cursor.execute(query, params)
-        return self.cursor.fetchall()
+        return self.pool.fetchall(query, params)
 
     def fetchone(self, query, params=()):
-        self.cursor.execute(query, params)
-        return self.cursor.fetchone()
+        return self.pool.fetchone(query, params)
 
     def close(self):
-        self.conn.close()
+        self.pool.close()
         DatabaseSingleton._instance = None
 
+async def run_db(fn, *args):
+    """Run one of the functions below on the database thread pool, off the event loop."""
+    return await DatabaseSingleton().pool.run(fn, *args)
+
 # ---------------------------- INIT ----------------------------
 
 def init_db():
@@ -64,20 +71,150 @@ def init_db():
             FOREIGN KEY(chat_id) REFERENCES chat(id) ON DELETE CASCADE
         );
     """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_created ON chat_messages(chat_id, created_at);")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_id ON chat_messages(chat_id, id);")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS context_chunks (
+            id TEXT PRIMARY KEY,
+            text TEXT NOT NULL
+        ) WITHOUT ROWID;
+    """)
+    if "context_refs" not in [column[1] for column in db.fetchall("PRAGMA table_info(chat_messages)")]:
+        db.execute("ALTER TABLE chat_messages ADD COLUMN context_refs TEXT;")
+    _migrate_context_refs(db)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_summary (
+            chat_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_until INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(chat_id) REFERENCES chat(id) ON DELETE CASCADE
+        );
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS evaluations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sample_hash TEXT NOT NULL UNIQUE,
+            chat_id INTEGER,
+            message_id INTEGER,
+            question TEXT NOT NULL,
+            documents TEXT NOT NULL,
+            context_precision REAL,
+            context_recall REAL,
+            faithfulness REAL,
+            answer_relevancy REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_evaluations_created ON evaluations(created_at);")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS document_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            action TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            job TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_name ON ingestion_jobs(name, status);")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS imported_bundles (
+            filename TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS tool_usage (
+            tool_name TEXT PRIMARY KEY,
+            calls INTEGER NOT NULL,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
 
 # ---------------------------- PDF ----------------------------
 
+# Every change to pdf_files is appended to document_changes in the same
+# transaction; its version column is the registry version workers sync against.
+
 def insert_pdf_file(filename, filepath, description):
+    """Register a document and return the new registry version."""
     db = DatabaseSingleton()
-    db.execute("INSERT INTO pdf_files (filename, filepath, description) VALUES (?, ?, ?)", (filename, filepath, description))
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO pdf_files (filename, filepath, description) VALUES (?, ?, ?)", (filename, filepath, description))
+        return conn.execute("INSERT INTO document_changes (filename, action) VALUES (?, 'upsert')", (filename,)).lastrowid
+
+def insert_pdf_files(rows):
+    """Insert many (filename, filepath, description) rows in one transaction."""
+    db = DatabaseSingleton()
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO pdf_files (filename, filepath, description) VALUES (?, ?, ?)", rows)
+        conn.executemany("INSERT INTO document_changes (filename, action) VALUES (?, 'upsert')", [(row[0],) for row in rows])
+
+def upsert_pdf_file(filename, filepath, description, bundle_sha256=None):
+    """
+    Register a document, or replace the row of one already registered, and return the new registry version.
+
+    Args:
+        bundle_sha256 (str, optional): Checksum of the index bundle the document was imported from.
+    """
+    db = DatabaseSingleton()
+    with db.transaction() as conn:
+        updated = conn.execute(
+            "UPDATE pdf_files SET filepath = ?, description = ? WHERE filename = ?", (filepath, description, filename)
+        ).rowcount
+        if not updated:
+            conn.execute("INSERT INTO pdf_files (filename, filepath, description) VALUES (?, ?, ?)", (filename, filepath, description))
+        if bundle_sha256:
+            conn.execute(
+                "INSERT OR REPLACE INTO imported_bundles (filename, sha256) VALUES (?, ?)", (filename, bundle_sha256)
+            )
+        return conn.execute("INSERT INTO document_changes (filename, action) VALUES (?, 'upsert')", (filename,)).lastrowid
+
+def get_imported_bundles():
+    """Return {filename: sha256} of the bundles documents were last imported from."""
+    db = DatabaseSingleton()
+    return dict(db.fetchall("SELECT filename, sha256 FROM imported_bundles"))
 
 def delete_pdf_file(filename):
+    """Remove a document and return the new registry version."""
+    db = DatabaseSingleton()
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM pdf_files WHERE filename = ?", (filename, ))
+        conn.execute("DELETE FROM imported_bundles WHERE filename = ?", (filename, ))
+        return conn.execute("INSERT INTO document_changes (filename, action) VALUES (?, 'delete')", (filename,)).lastrowid
+
+def record_document_change(filename, action):
+    """Record that a document's index changed in place (e.g. re-indexed); returns the new version."""
     db = DatabaseSingleton()
-    db.execute("DELETE FROM pdf_files WHERE filename = ?", (filename, ))
+    return db.execute("INSERT INTO document_changes (filename, action) VALUES (?, ?)", (filename, action))
+
+def get_registry_version():
+    db = DatabaseSingleton()
+    return db.fetchone("SELECT COALESCE(MAX(version), 0) FROM document_changes")[0]
+
+def get_document_changes(since_version):
+    """Return (version, filename, action) rows newer than since_version, oldest first."""
+    db = DatabaseSingleton()
+    return db.fetchall(
+        "SELECT version, filename, action FROM document_changes WHERE version > ? ORDER BY version",
+        (since_version,)
+    )
 
 def get_file(filename):
+    """Return (filename, filepath, description) of a registered document, or None."""
     db = DatabaseSingleton()
     result = db.fetchall("SELECT filename, filepath, description FROM pdf_files WHERE filename = ?", (filename, ))
+    if not result:
+        return None
     filename, filepath, index_id = result[0]
     return filename, filepath, index_id
 
@@ -87,12 +224,51 @@ def get_all_files():
     columns = ['id', 'filename', 'filepath', 'description','uploaded_at']
     return [dict(zip(columns, row)) for row in rows]
 
+def record_tool_usage(tool_names):
+    """Count one call for each of the given tools."""
+    db = DatabaseSingleton()
+    db.executemany("""
+        INSERT INTO tool_usage (tool_name, calls) VALUES (?, 1)
+        ON CONFLICT(tool_name) DO UPDATE SET calls = calls + 1, last_used = CURRENT_TIMESTAMP
+    """, [(name,) for name in tool_names])
+
+def get_tool_usage():
+    """Return {tool_name: number of calls}."""
+    db = DatabaseSingleton()
+    return dict(db.fetchall("SELECT tool_name, calls FROM tool_usage"))
+
+# ---------------------------- Ingestion Jobs ----------------------------
+
+def save_job(job):
+    db = DatabaseSingleton()
+    db.execute("""
+        INSERT INTO ingestion_jobs (id, name, status, job, updated_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET status = excluded.status, job = excluded.job, updated_at = excluded.updated_at
+    """, (job["id"], job["name"], job["status"], json.dumps(job, default=str), time.time()))
+
+def load_job(job_id):
+    db = DatabaseSingleton()
+    row = db.fetchone("SELECT job FROM ingestion_jobs WHERE id = ?", (job_id,))
+    return json.loads(row[0]) if row else None
+
+def get_active_jobs(name, updated_since):
+    """Return queued or running jobs for a name that reported progress after updated_since."""
+    db = DatabaseSingleton()
+    rows = db.fetchall("""
+        SELECT job FROM ingestion_jobs
+        WHERE name = ? AND status IN ('queued', 'running') AND updated_at > ?
+    """, (name, updated_since))
+    return [json.loads(row[0]) for row in rows]
+
+def delete_jobs_before(updated_before):
+    db = DatabaseSingleton()
+    db.execute("DELETE FROM ingestion_jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?", (updated_before,))
+
 # ---------------------------- Chat ----------------------------
 
 def insert_chat(name):
     db = DatabaseSingleton()
-    db.execute("INSERT INTO chat (name) VALUES (?)", (name,))
-    return db.cursor.lastrowid
+    return db.execute("INSERT INTO chat (name) VALUES (?)", (name,))
 
 def get_all_chats():
     db = DatabaseSingleton()
@@ -102,8 +278,9 @@ def get_all_chats():
 
 def update_chat_name(chat_id, new_name):
     db = DatabaseSingleton()
-    db.execute("UPDATE chat SET name = ? WHERE id = ?", (new_name, chat_id))
-    return db.fetchone("SELECT name FROM chat WHERE id = ?", (chat_id,))[0]
+    with db.transaction() as conn:
+        conn.execute("UPDATE chat SET name = ? WHERE id = ?", (new_name, chat_id))
+        return conn.execute("SELECT name FROM chat WHERE id = ?", (chat_id,)).fetchone()[0]
 
 def delete_chat(chat_id):
     db = DatabaseSingleton()
@@ -111,51 +288,219 @@ def delete_chat(chat_id):
 
 # ---------------------------- Chat Messages ----------------------------
 
-def insert_chat_message(chat_id, usermessage, botmessage, context):
+def chunk_id(text):
+    """Content address of a context chunk in context_chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def _store_chunks(conn, texts):
+    ids = [chunk_id(text) for text in texts]
+    conn.executemany("INSERT OR IGNORE INTO context_chunks (id, text) VALUES (?, ?)", list(zip(ids, texts)))
+    return ids
+
+def store_context_chunks(texts):
+    """Store context texts once each and return their chunk ids, in order."""
     db = DatabaseSingleton()
-    if isinstance(context, list):
-        context = json.dumps(context)
-    db.execute("""
-        INSERT INTO chat_messages (chat_id, usermessage, botmessage, context)
-        VALUES (?, ?, ?, ?)
-    """, (chat_id, usermessage, botmessage, context))
-    return db.cursor.lastrowid
+    with db.transaction() as conn:
+        return _store_chunks(conn, texts)
 
-def get_chat_messages(chat_id):
+def get_context_chunks(ids):
+    """Return {chunk id: text} for the given ids that exist."""
     db = DatabaseSingleton()
-    rows = db.fetchall("SELECT id, chat_id, usermessage, botmessage FROM chat_messages WHERE chat_id = ?", (chat_id,))
-    return [{'id':r[0], 'chat_id':r[1], 'usermessage': r[2], 'botmessage': r[3]} for r in rows]
+    ids = list(dict.fromkeys(ids))
+    chunks = {}
+    for i in range(0, len(ids), 500):
+        batch = ids[i:i + 500]
+        chunks.update(db.fetchall(
+            f"SELECT id, text FROM context_chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+        ))
+    return chunks
 
-def get_all_chat_messages():
+def insert_chat_message(chat_id, usermessage, botmessage, context=None, context_ids=None):
+    """
+    Store a chat turn. Context is kept as references into context_chunks.
+
+    Args:
+        context (list[str] | str, optional): Context texts, or their JSON encoding.
+        context_ids (list[str], optional): Ids of chunks already stored, e.g. from a
+            /query response in refs mode. Used when no context texts are given.
+    """
     db = DatabaseSingleton()
-    rows = db.fetchall("SELECT id, chat_id, usermessage, botmessage, context FROM chat_messages")
+    if isinstance(context, str):
+        context = _decode_context(context)
+    with db.transaction() as conn:
+        refs = _store_chunks(conn, context) if context else list(context_ids or [])
+        return conn.execute("""
+            INSERT INTO chat_messages (chat_id, usermessage, botmessage, context, context_refs)
+            VALUES (?, ?, ?, '[]', ?)
+        """, (chat_id, usermessage, botmessage, json.dumps(refs))).lastrowid
+
+def _decode_context(context):
+    try:
+        return json.loads(context)
+    except (json.JSONDecodeError, TypeError):
+        return []
+
+def _message_rows(rows, include_context):
+    """
+    Build message dicts. include_context is False, True (resolve context texts)
+    or "refs" (return chunk ids as context_ids).
+    """
     messages = []
     for r in rows:
-        try:
-            context = json.loads(r[4])
-        except (json.JSONDecodeError, TypeError):
-            context = []  
-        messages.append({
-            'id': r[0],
-            'chat_id': r[1],
-            'usermessage': r[2],
-            'botmessage': r[3],
-            'context': context
-        })
+        message = {'id': r[0], 'chat_id': r[1], 'usermessage': r[2], 'botmessage': r[3]}
+        if include_context:
+            # Rows written before context_refs existed still carry their texts inline.
+            if r[5] is None:
+                message['context'] = _decode_context(r[4])
+            else:
+                message['context_ids'] = _decode_context(r[5])
+        messages.append(message)
+
+    if include_context is True:
+        chunks = get_context_chunks([i for m in messages for i in m.get('context_ids', [])])
+        for message in messages:
+            if 'context_ids' in message:
+                message['context'] = [chunks[i] for i in message.pop('context_ids') if i in chunks]
     return messages
 
+def _migrate_context_refs(db, batch_size=500):
+    """Move inline context of older messages into context_chunks."""
+    while True:
+        rows = db.fetchall("SELECT id, context FROM chat_messages WHERE context_refs IS NULL LIMIT ?", (batch_size,))
+        if not rows:
+            return
+        with db.transaction() as conn:
+            for message_id, context in rows:
+                refs = _store_chunks(conn, _decode_context(context))
+                conn.execute(
+                    "UPDATE chat_messages SET context = '[]', context_refs = ? WHERE id = ?",
+                    (json.dumps(refs), message_id)
+                )
+
+def get_chat_messages(chat_id, limit=None, cursor=None, include_context=False):
+    """
+    Return one chat's messages in order, optionally one page at a time.
+
+    Args:
+        chat_id (int): Chat id.
+        limit (int, optional): Page size; all remaining messages when omitted.
+        cursor (int, optional): Return only messages after this message id.
+        include_context (bool | str): Include the context texts; "refs" includes only their chunk ids.
+    """
+    # Ordered by id alone, the key the cursor compares on, so pages never skip or repeat messages.
+    db = DatabaseSingleton()
+    columns = "id, chat_id, usermessage, botmessage" + (", context, context_refs" if include_context else "")
+    rows = db.fetchall(f"""
+        SELECT {columns} FROM chat_messages
+        WHERE chat_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    """, (chat_id, cursor or 0, limit if limit else -1))
+    return _message_rows(rows, include_context)
+
+def get_chat_history(chat_id):
+    """Return a chat's (usermessage, botmessage) pairs in order."""
+    db = DatabaseSingleton()
+    return db.fetchall("""
+        SELECT usermessage, botmessage FROM chat_messages
+        WHERE chat_id = ?
+        ORDER BY id
+    """, (chat_id,))
+
+def get_all_chat_messages(limit=None, cursor=None, include_context=True):
+    db = DatabaseSingleton()
+    columns = "id, chat_id, usermessage, botmessage" + (", context, context_refs" if include_context else "")
+    rows = db.fetchall(f"""
+        SELECT {columns} FROM chat_messages
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    """, (cursor or 0, limit if limit else -1))
+    return _message_rows(rows, include_context)
+
 def delete_messages_after(message_id, chat_id):
     db = DatabaseSingleton()
-    result = db.fetchone(
-        "SELECT created_at FROM chat_messages WHERE id = ? AND chat_id = ?",
-        (message_id, chat_id)
-    )
-    if not result:
-        raise ValueError("Message not found for deletion.")
-    created_at = result[0]
-    db.execute(
-        "DELETE FROM chat_messages WHERE chat_id = ? AND created_at >= ?",
-        (chat_id, created_at)
+    with db.transaction() as conn:
+        result = conn.execute(
+            "SELECT 1 FROM chat_messages WHERE id = ? AND chat_id = ?",
+            (message_id, chat_id)
+        ).fetchone()
+        if not result:
+            raise ValueError("Message not found for deletion.")
+        # Ids, unlike timestamps, are unique and increase in insertion order, as pagination and summaries assume.
+        conn.execute(
+            "DELETE FROM chat_messages WHERE chat_id = ? AND id >= ?",
+            (chat_id, message_id)
+        )
+
+# ---------------------------- Chat Summary ----------------------------
+
+def get_chat_summary(chat_id):
+    """Return (summary, id of the last message folded into it); ("", 0) if none."""
+    db = DatabaseSingleton()
+    row = db.fetchone("SELECT summary, summarized_until FROM chat_summary WHERE chat_id = ?", (chat_id,))
+    return row if row else ("", 0)
+
+def upsert_chat_summary(chat_id, summary, summarized_until):
+    db = DatabaseSingleton()
+    db.execute("""
+        INSERT INTO chat_summary (chat_id, summary, summarized_until) VALUES (?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            summary = excluded.summary,
+            summarized_until = excluded.summarized_until,
+            updated_at = CURRENT_TIMESTAMP
+    """, (chat_id, summary, summarized_until))
+
+def reset_chat_summary_after(chat_id, message_id):
+    """Drop a chat's summary if it covers a message that is being deleted."""
+    db = DatabaseSingleton()
+    db.execute("DELETE FROM chat_summary WHERE chat_id = ? AND summarized_until >= ?", (chat_id, message_id))
+
+# ---------------------------- Evaluations ----------------------------
+
+EVALUATION_METRICS = ['context_precision', 'context_recall', 'faithfulness', 'answer_relevancy']
+
+def get_evaluation(sample_hash):
+    db = DatabaseSingleton()
+    row = db.fetchone(
+        f"SELECT {', '.join(EVALUATION_METRICS)} FROM evaluations WHERE sample_hash = ?",
+        (sample_hash,)
     )
+    return dict(zip(EVALUATION_METRICS, row)) if row else None
 
+def insert_evaluation(sample_hash, question, documents, scores, chat_id=None, message_id=None):
+    db = DatabaseSingleton()
+    db.execute(f"""
+        INSERT OR IGNORE INTO evaluations (sample_hash, chat_id, message_id, question, documents, {', '.join(EVALUATION_METRICS)})
+        VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(EVALUATION_METRICS))})
+    """, (sample_hash, chat_id, message_id, question, json.dumps(documents),
+          *[scores.get(metric) for metric in EVALUATION_METRICS]))
+
+def get_evaluation_report(group_by, since=None, until=None):
+    """
+    Average metric scores per document or per day.
 
+    Args:
+        group_by (str): "document" or "day".
+        since (str, optional): Only include evaluations created at or after this timestamp.
+        until (str, optional): Only include evaluations created before this timestamp.
+    """
+    db = DatabaseSingleton()
+    if group_by == "document":
+        source = "evaluations, json_each(evaluations.documents) AS doc"
+        key = "doc.value"
+    elif group_by == "day":
+        source = "evaluations"
+        key = "date(evaluations.created_at)"
+    else:
+        raise ValueError("group_by must be 'document' or 'day'")
+
+    averages = ", ".join(f"AVG(evaluations.{metric})" for metric in EVALUATION_METRICS)
+    rows = db.fetchall(f"""
+        SELECT {key}, COUNT(*), {averages} FROM {source}
+        WHERE evaluations.created_at >= ? AND evaluations.created_at < ?
+        GROUP BY {key}
+        ORDER BY {key}
+    """, (since or "0000-00-00", until or "9999-12-31"))
+    columns = ['group', 'samples'] + EVALUATION_METRICS
+    return [dict(zip(columns, row)) for row in rows]
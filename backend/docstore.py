@@ -0,0 +1,199 @@
+import os
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from llama_index.core import StorageContext
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION
+from dotenv import load_dotenv
+from sqlite_pool import ConnectionPool
+
+load_dotenv()
+
+STORAGE_CONTEXT_PATH = os.getenv("STORAGE_CONTEXT_PATH")
+DOCSTORE_BACKEND = os.getenv("DOCSTORE_BACKEND", "sqlite").lower()
+DOCSTORE_PATH = os.getenv("DOCSTORE_PATH") or os.path.join(STORAGE_CONTEXT_PATH or ".", "docstore.sqlite3")
+DOCSTORE_CACHE_SIZE = int(os.getenv("DOCSTORE_CACHE_SIZE", "4096"))
+
+
+class SQLiteKVStore(BaseKVStore):
+    """
+    llama_index key-value store on a single SQLite table.
+
+    Values are read one key at a time as they are requested, and the raw JSON of
+    the DOCSTORE_CACHE_SIZE most recently read values is kept in memory, so only
+    the nodes retrieval actually touches are ever resident. Callers get a freshly
+    decoded dict each time and may mutate it.
+    """
+
+    def __init__(self, path: str, cache_size: int = DOCSTORE_CACHE_SIZE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.pool = ConnectionPool(path, size=1, stage="docstore")
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.pool.execute("""
+            CREATE TABLE IF NOT EXISTS kv (
+                collection TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (collection, key)
+            ) WITHOUT ROWID;
+        """)
+
+    def _cache_put(self, cache_key, value):
+        with self._lock:
+            self._cache[cache_key] = value
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, keys):
+        with self._lock:
+            for cache_key in keys:
+                self._cache.pop(cache_key, None)
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    def put_all(self, kv_pairs: List[Tuple[str, dict]], collection: str = DEFAULT_COLLECTION,
+                batch_size: int = 1) -> None:
+        if not kv_pairs:
+            return
+        self.pool.executemany(
+            "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+            [(collection, key, json.dumps(val)) for key, val in kv_pairs]
+        )
+        self._cache_drop([(collection, key) for key, _ in kv_pairs])
+
+    async def aput_all(self, kv_pairs: List[Tuple[str, dict]], collection: str = DEFAULT_COLLECTION,
+                       batch_size: int = 1) -> None:
+        self.put_all(kv_pairs, collection, batch_size)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        cache_key = (collection, key)
+        with self._lock:
+            raw = self._cache.get(cache_key)
+            if raw is not None:
+                self._cache.move_to_end(cache_key)
+        if raw is None:
+            row = self.pool.fetchone("SELECT value FROM kv WHERE collection = ? AND key = ?", (collection, key))
+            if row is None:
+                return None
+            raw = row[0]
+            self._cache_put(cache_key, raw)
+        return json.loads(raw)
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        rows = self.pool.fetchall("SELECT key, value FROM kv WHERE collection = ?", (collection,))
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        self._cache_drop([(collection, key)])
+        with self.pool.transaction() as conn:
+            return conn.execute("DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key)).rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+    @staticmethod
+    def _prefix_range(prefix: str) -> Tuple[str, str]:
+        """Key range of the collections starting with a non-empty prefix, so lookups seek instead of scanning."""
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def has_prefix(self, prefix: str) -> bool:
+        return self.pool.fetchone(
+            "SELECT 1 FROM kv WHERE collection >= ? AND collection < ? LIMIT 1", self._prefix_range(prefix)
+        ) is not None
+
+    def delete_prefix(self, prefix: str):
+        """Delete every collection whose name starts with prefix."""
+        self.pool.execute("DELETE FROM kv WHERE collection >= ? AND collection < ?", self._prefix_range(prefix))
+        self.evict_prefix(prefix)
+
+    def evict_prefix(self, prefix: str):
+        """Drop cached values of collections starting with prefix, e.g. after another process rewrote them."""
+        with self._lock:
+            for cache_key in [k for k in self._cache if k[0].startswith(prefix)]:
+                del self._cache[cache_key]
+
+
+_kvstore = None
+_kvstore_lock = threading.Lock()
+
+
+def shared_kvstore() -> SQLiteKVStore:
+    global _kvstore
+    with _kvstore_lock:
+        if _kvstore is None:
+            _kvstore = SQLiteKVStore(DOCSTORE_PATH)
+        return _kvstore
+
+
+def _namespace(name: str) -> str:
+    return f"{name}/docstore"
+
+
+def _persist_dir(name: str) -> str:
+    return f"{STORAGE_CONTEXT_PATH}/{name}"
+
+
+def load_storage_context(name: str, vector_store, create: bool = False) -> StorageContext:
+    """
+    Return the storage context holding a document's node hierarchy.
+
+    With the sqlite backend the docstore reads nodes on demand from DOCSTORE_PATH.
+    A document still persisted as JSON under STORAGE_CONTEXT_PATH is copied into
+    SQLite the first time it is loaded.
+
+    Args:
+        name (str): Name of the document collection.
+        vector_store: The document's vector store.
+        create (bool): The document is being (re)built; start from an empty docstore.
+    """
+    if DOCSTORE_BACKEND == "json":
+        if create or not os.path.isdir(_persist_dir(name)):
+            return StorageContext.from_defaults(vector_store=vector_store)
+        return StorageContext.from_defaults(vector_store=vector_store, persist_dir=_persist_dir(name))
+
+    kvstore = shared_kvstore()
+    if create:
+        kvstore.delete_prefix(f"{name}/")
+    docstore = KVDocumentStore(kvstore, namespace=_namespace(name), batch_size=500)
+    if not create and not kvstore.has_prefix(_namespace(name)) and os.path.isdir(_persist_dir(name)):
+        legacy = SimpleDocumentStore.from_persist_dir(_persist_dir(name))
+        docstore.add_documents(list(legacy.docs.values()))
+        print(f"Migrated docstore for {name} to SQLite")
+    return StorageContext.from_defaults(vector_store=vector_store, docstore=docstore)
+
+
+def persist_storage_context(name: str, storage_context: StorageContext):
+    """Write a document's storage context; SQLite docstores are already durable."""
+    if DOCSTORE_BACKEND == "json":
+        storage_context.persist(persist_dir=_persist_dir(name))
+
+
+def evict_cached_nodes(name: str):
+    """Forget this process's cached nodes of a document so they are re-read from disk."""
+    if _kvstore is not None:
+        _kvstore.evict_prefix(f"{name}/")
+
+
+def delete_storage(name: str):
+    """Remove a document's node hierarchy from every backend."""
+    if DOCSTORE_BACKEND != "json" or os.path.exists(DOCSTORE_PATH):
+        shared_kvstore().delete_prefix(f"{name}/")
+    if os.path.isdir(_persist_dir(name)):
+        shutil.rmtree(_persist_dir(name), ignore_errors=True)
@@ -0,0 +1,164 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Any, List
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+DB_PATH = os.getenv("DB_PATH")
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(DB_PATH or "") or ".", "embedding_cache.sqlite3")
+)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Disk-backed, content-addressed cache in front of another embedding model.
+
+    Text embeddings are stored in SQLite keyed on (model name, sha256 of the text),
+    so re-ingesting unchanged chunks never calls the wrapped model again. The least
+    recently used entries are dropped once the cache grows past max_entries.
+    Query embeddings are passed straight through.
+    """
+
+    inner: BaseEmbedding
+    cache_path: str
+    max_entries: int
+
+    _conn: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _size: int = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(self, inner: BaseEmbedding, cache_path: str = EMBEDDING_CACHE_PATH,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, **kwargs: Any):
+        super().__init__(
+            inner=inner,
+            cache_path=cache_path,
+            max_entries=max_entries,
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs
+        )
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            );
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used);")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _lookup(self, hashes: List[str]) -> dict:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT hash, embedding FROM embedding_cache WHERE model = ? AND hash IN ({placeholders})",
+                    (self.model_name, *chunk)
+                ).fetchall()
+                found.update({h: np.frombuffer(blob, dtype=np.float32).tolist() for h, blob in rows})
+            if found:
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, self.model_name, h) for h in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items: dict):
+        now = time.time()
+        rows = [(self.model_name, h, np.asarray(e, dtype=np.float32).tobytes(), now) for h, e in items.items()]
+        with self._lock:
+            # Keys cached meanwhile (by another request or worker) are refreshed, not counted again.
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embedding_cache (model, hash, embedding, last_used) VALUES (?, ?, ?, ?)", rows
+            ).rowcount
+            if inserted < len(rows):
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET embedding = ?, last_used = ? WHERE model = ? AND hash = ?",
+                    [(blob, last_used, model, h) for model, h, blob, last_used in rows]
+                )
+            self._size += inserted
+            if self._size > self.max_entries:
+                self._conn.execute("""
+                    DELETE FROM embedding_cache WHERE rowid IN (
+                        SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?
+                    )
+                """, (self._size - self.max_entries,))
+                self._size = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            self._conn.commit()
+
+    def _split(self, texts: List[str]) -> tuple[list, dict, list]:
+        hashes = [text_hash(text) for text in texts]
+        found = self._lookup(list(set(hashes)))
+        missing = list({h: text for h, text in zip(hashes, texts) if h not in found}.items())
+        self._hits += len(found)
+        self._misses += len(missing)
+        return hashes, found, missing
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        hashes, found, missing = self._split(texts)
+        if missing:
+            embeddings = self.inner.get_text_embedding_batch([text for _, text in missing])
+            new = {h: e for (h, _), e in zip(missing, embeddings)}
+            self._store(new)
+            found.update(new)
+        return [found[h] for h in hashes]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        hashes, found, missing = self._split(texts)
+        if missing:
+            embeddings = await self.inner.aget_text_embedding_batch([text for _, text in missing])
+            new = {h: e for (h, _), e in zip(missing, embeddings)}
+            self._store(new)
+            found.update(new)
+        return [found[h] for h in hashes]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self.inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self.inner.aget_query_embedding(query)
+
+    def stats(self) -> dict:
+        total = self._hits + self._misses
+        return {
+            "entries": self._size,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+        }
@@ -0,0 +1,112 @@
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+from rag import evaluate_sample
+from database import run_db, get_evaluation, insert_evaluation, EVALUATION_METRICS
+
+load_dotenv()
+
+EVALUATION_CONCURRENCY = int(os.getenv("EVALUATION_CONCURRENCY", "4"))
+MAX_KEPT_BATCHES = 100
+
+
+def sample_hash(question: str, context: list[str], answer: str, ground_truth: str) -> str:
+    return hashlib.sha256(json.dumps([question, context, answer, ground_truth]).encode("utf-8")).hexdigest()
+
+
+class EvaluationRunner:
+    """
+    Scores RAG samples with RAGAS on worker threads, at most EVALUATION_CONCURRENCY at a time.
+
+    Scores are stored in the evaluations table keyed on a hash of the sample, so
+    evaluating an identical sample again is answered from the database.
+    """
+
+    def __init__(self, concurrency: int = EVALUATION_CONCURRENCY):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batches = {}
+        self._tasks = set()
+
+    async def evaluate(self, sample: dict) -> dict:
+        """
+        Score one sample.
+
+        Args:
+            sample (dict): question, context, answer, and optionally ground_truth,
+                documents, chat_id and message_id.
+
+        Returns:
+            dict: Metric scores plus "cached" telling whether they came from the database.
+        """
+        question = sample["question"]
+        context = sample["context"]
+        answer = sample["answer"]
+        ground_truth = sample.get("ground_truth", "")
+        key = sample_hash(question, context, answer, ground_truth)
+
+        scores = await run_db(get_evaluation, key)
+        if scores is not None:
+            return {**scores, "cached": True}
+
+        async with self.semaphore:
+            raw = await asyncio.to_thread(evaluate_sample, question, context, answer, ground_truth)
+        scores = {metric: raw.get(metric) for metric in EVALUATION_METRICS}
+        await run_db(insert_evaluation, key, question, sample.get("documents", []), scores,
+                     sample.get("chat_id"), sample.get("message_id"))
+        return {**scores, "cached": False}
+
+    def start(self, samples: list[dict]) -> str:
+        """Queue a batch of samples and return its id; results accumulate as they finish."""
+        finished = [b for b, batch in self.batches.items() if len(batch["results"]) >= batch["total"]]
+        for old in finished[:max(0, len(self.batches) - MAX_KEPT_BATCHES + 1)]:
+            del self.batches[old]
+
+        batch_id = uuid.uuid4().hex
+        batch = {"id": batch_id, "total": len(samples), "results": [], "updated": asyncio.Event()}
+        self.batches[batch_id] = batch
+
+        async def run(index, sample):
+            try:
+                result = {"index": index, "scores": await self.evaluate(sample)}
+            except Exception as e:
+                result = {"index": index, "error": str(e)}
+            batch["results"].append(result)
+            batch["updated"].set()
+
+        for index, sample in enumerate(samples):
+            task = asyncio.create_task(run(index, sample))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return batch_id
+
+    def status(self, batch_id: str) -> dict | None:
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        return {
+            "id": batch_id,
+            "total": batch["total"],
+            "completed": len(batch["results"]),
+            "results": sorted(batch["results"], key=lambda r: r["index"])
+        }
+
+    async def stream(self, batch_id: str):
+        """Yield per-sample results in completion order until the batch is done."""
+        batch = self.batches[batch_id]
+        sent = 0
+        while True:
+            while sent < len(batch["results"]):
+                yield batch["results"][sent]
+                sent += 1
+            if sent >= batch["total"]:
+                return
+            batch["updated"].clear()
+            if sent < len(batch["results"]):
+                continue
+            await batch["updated"].wait()
+
+
+evaluation_runner = EvaluationRunner()
@@ -0,0 +1,142 @@
+"""
+Bulk ingestion of a directory of PDF leaflets.
+
+Usage:
+    python ingest.py <directory> [--parse-workers N] [--embed-concurrency N]
+
+Up to --parse-workers PDFs are parsed at once (with PDF_PARSER=local each
+document's pages are spread over a process pool, and files parsed before come
+from the parse cache). Each is chunked as soon as its parse finishes, and its leaf
+nodes are embedded in concurrent batches that retry on rate limits and other
+transient API errors.
+Each finished document is written to Chroma (see VECTOR_LAYOUT) and its docstore
+and recorded in a state file, so an interrupted run resumes where it stopped.
+The pdf_files rows are inserted in one transaction at the end. Files already
+present in pdf_files are skipped. Running servers pick up the new documents
+through the document registry.
+"""
+import os
+import json
+import shutil
+import asyncio
+import argparse
+import openai
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from llama_index.core import Settings
+from llama_index.core.schema import MetadataMode
+from dotenv import load_dotenv
+from rag import parse_pdf, chunk_text, build_index, describe_document
+from database import init_db, get_all_files, insert_pdf_files
+
+load_dotenv()
+
+FOLDER_PATH = os.getenv("FOLDER_PATH")
+EMBED_BATCH_SIZE = 100
+# Errors worth waiting out; anything else (bad key, bad input, a bug) fails the file at once.
+TRANSIENT_EMBED_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def load_state(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"done": {}}
+
+
+def save_state(path: str, state: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+@retry(
+    retry=retry_if_exception_type(TRANSIENT_EMBED_ERRORS),
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(8),
+    reraise=True
+)
+async def embed_batch(texts: list[str]) -> list:
+    return await Settings.embed_model.aget_text_embedding_batch(texts)
+
+
+async def ingest_file(path: str, parse_limit: asyncio.Semaphore, embed_limit: asyncio.Semaphore,
+                      state: dict, state_path: str, state_lock: asyncio.Lock):
+    filename = os.path.basename(path)
+    name = os.path.splitext(filename)[0]
+
+    async with parse_limit:
+        text = await asyncio.to_thread(parse_pdf, path)
+    all_nodes, leaf_nodes = await asyncio.to_thread(chunk_text, text)
+
+    async def embed(batch):
+        async with embed_limit:
+            embeddings = await embed_batch([node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch])
+        for node, embedding in zip(batch, embeddings):
+            node.embedding = embedding
+
+    await asyncio.gather(*[
+        embed(leaf_nodes[i:i + EMBED_BATCH_SIZE]) for i in range(0, len(leaf_nodes), EMBED_BATCH_SIZE)
+    ])
+
+    # build_index starts from empty vectors, so a partial write from a crash is discarded.
+    await asyncio.to_thread(build_index, name, all_nodes, leaf_nodes)
+
+    filepath = os.path.join(FOLDER_PATH, filename)
+    if os.path.abspath(path) != os.path.abspath(filepath):
+        shutil.copyfile(path, filepath)
+
+    async with state_lock:
+        state["done"][filename] = {"filepath": filepath, "description": describe_document(name)}
+        save_state(state_path, state)
+    print(f"Indexed {filename} ({len(leaf_nodes)} leaf nodes)")
+
+
+async def ingest_directory(directory: str, parse_workers: int, embed_concurrency: int, state_path: str):
+    init_db()
+    os.makedirs(FOLDER_PATH, exist_ok=True)
+
+    state = load_state(state_path)
+    indexed = {file["filename"] for file in get_all_files()}
+    pending = sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if f.lower().endswith(".pdf") and f not in indexed and f not in state["done"]
+    )
+    print(f"{len(pending)} PDFs to ingest, {len(state['done'])} already done in a previous run")
+
+    parse_limit = asyncio.Semaphore(parse_workers)
+    embed_limit = asyncio.Semaphore(embed_concurrency)
+    state_lock = asyncio.Lock()
+    results = await asyncio.gather(*[
+        ingest_file(path, parse_limit, embed_limit, state, state_path, state_lock) for path in pending
+    ], return_exceptions=True)
+
+    for path, result in zip(pending, results):
+        if isinstance(result, Exception):
+            print(f"Failed to ingest {os.path.basename(path)}: {result}")
+
+    rows = [
+        (filename, entry["filepath"], entry["description"])
+        for filename, entry in state["done"].items() if filename not in indexed
+    ]
+    insert_pdf_files(rows)
+    print(f"Registered {len(rows)} documents")
+
+    if os.path.exists(state_path) and not any(isinstance(result, Exception) for result in results):
+        os.remove(state_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory of PDF leaflets.")
+    parser.add_argument("directory", help="Directory containing PDF files")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count(), help="PDFs parsed at once")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="Embedding batches in flight at once")
+    parser.add_argument("--state", default=None, help="Resume state file (default: <directory>/.ingest_state.json)")
+    args = parser.parse_args()
+
+    state_path = args.state or os.path.join(args.directory, ".ingest_state.json")
+    asyncio.run(ingest_directory(args.directory, args.parse_workers, args.embed_concurrency, state_path))
+
+
+if __name__ == "__main__":
+    main()
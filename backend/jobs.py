@@ -0,0 +1,120 @@
+import os
+import time
+import uuid
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from database import run_db, save_job, load_job, get_active_jobs, delete_jobs_before
+
+load_dotenv()
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "900"))
+
+
+class JobQueue:
+    """
+    Background job runner for blocking work such as PDF ingestion.
+
+    Jobs run on a bounded thread pool so the event loop stays responsive. The
+    on_success/on_failure callbacks run back on the event loop, which makes them
+    the place to update shared server state atomically.
+
+    Job status is mirrored to the ingestion_jobs table so that any worker can
+    report it and refuse a duplicate upload. A queued or running job that has
+    not reported progress for JOB_STALE_SECONDS is assumed to have died with its
+    worker.
+    """
+
+    def __init__(self, max_workers: int = INGESTION_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.jobs = {}
+        self._tasks = set()
+
+    def submit(self, name: str, work, on_success=None, on_failure=None) -> str:
+        """
+        Queue a job.
+
+        Args:
+            name (str): Name of the item being processed (e.g. the PDF filename).
+            work (callable): Blocking function called as work(progress), where
+                progress(stage, percent) updates the job status.
+            on_success (callable, optional): Called (or awaited) on the event loop with the
+                result of work. A non-None return value is stored as the job's "result".
+            on_failure (callable, optional): Called (or awaited) on the event loop with the raised exception.
+
+        Returns:
+            str: Job id.
+        """
+        self._prune()
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = {
+            "id": job_id,
+            "name": name,
+            "status": "queued",
+            "stage": None,
+            "progress": 0,
+            "error": None,
+            "result": None,
+            "created_at": time.time(),
+            "finished_at": None
+        }
+        task = asyncio.create_task(self._run(job_id, work, on_success, on_failure))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job_id
+
+    async def _run(self, job_id, work, on_success, on_failure):
+        job = self.jobs[job_id]
+        await run_db(save_job, job)
+        await run_db(delete_jobs_before, time.time() - JOB_RETENTION_SECONDS)
+
+        def progress(stage, percent):
+            job["status"] = "running"
+            job["stage"] = stage
+            job["progress"] = round(percent, 1)
+            save_job(job)
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, work, progress)
+            if on_success:
+                summary = on_success(result)
+                job["result"] = await summary if inspect.isawaitable(summary) else summary
+            job.update(status="done", stage=None, progress=100)
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+            if on_failure:
+                cleanup = on_failure(e)
+                if inspect.isawaitable(cleanup):
+                    await cleanup
+        finally:
+            job["finished_at"] = time.time()
+            await run_db(save_job, job)
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [
+            job_id for job_id, job in self.jobs.items()
+            if job["finished_at"] and now - job["finished_at"] > JOB_RETENTION_SECONDS
+        ]:
+            del self.jobs[job_id]
+
+    async def get(self, job_id: str) -> dict | None:
+        """Return a job submitted to any worker."""
+        return self.jobs.get(job_id) or await run_db(load_job, job_id)
+
+    def active(self, name: str | None = None) -> list[dict]:
+        """Return this worker's queued or running jobs, optionally only those for one name."""
+        return [
+            job for job in self.jobs.values()
+            if job["status"] in ("queued", "running") and (name is None or job["name"] == name)
+        ]
+
+    async def active_anywhere(self, name: str) -> list[dict]:
+        """Return queued or running jobs for a name across all workers."""
+        return self.active(name) or await run_db(get_active_jobs, name, time.time() - JOB_STALE_SECONDS)
+
+
+ingestion_jobs = JobQueue()
@@ -0,0 +1,134 @@
+import time
+import uuid
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any
+from prometheus_client import Counter, Gauge, Histogram
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatStartEvent,
+    LLMChatEndEvent,
+    LLMCompletionStartEvent,
+    LLMCompletionEndEvent,
+)
+from llama_index.core.utils import get_tokenizer
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds", "Time spent in each stage of request handling.", ["stage"], buckets=STAGE_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "rag_request_duration_seconds", "HTTP request latency.", ["method", "route", "status"], buckets=STAGE_BUCKETS
+)
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens sent to and received from the LLM.", ["direction"])
+QUERY_PATHS = Counter("rag_query_path_total", "Answered queries by path.", ["path"])
+RERANK_BATCH_PAIRS = Histogram(
+    "rag_rerank_batch_pairs", "(query, passage) pairs per cross-encoder forward pass.",
+    buckets=(1, 4, 8, 16, 32, 64, 128, 256)
+)
+TOOLS_LOADED = Gauge("rag_tools_loaded", "Document tools loaded and ready to query.")
+DOCUMENTS_REGISTERED = Gauge("rag_documents_registered", "Documents registered in the database.")
+INGESTION_JOBS = Gauge("rag_ingestion_jobs", "Ingestion jobs by status.", ["status"])
+CACHE_HIT_RATE = Gauge("rag_cache_hit_rate", "Hit rate of each cache since startup.", ["cache"])
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_spans = contextvars.ContextVar("spans", default=None)
+
+
+def start_trace(trace_id: str | None = None) -> str:
+    """Begin collecting spans for the current request and return its trace id."""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    _spans.set([])
+    return trace_id
+
+
+def current_trace() -> str | None:
+    return _trace_id.get()
+
+
+def log(message: str):
+    """print, prefixed with the current trace id when there is one."""
+    trace_id = _trace_id.get()
+    print(f"[trace {trace_id}] {message}" if trace_id else message)
+
+
+def observe(stage: str, seconds: float):
+    """Record a finished span in the stage histogram and in the current trace."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as one span of the given stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def trace_summary() -> str:
+    """One line with the count and total time of each stage recorded in the current trace."""
+    totals = defaultdict(lambda: [0, 0.0])
+    for stage, seconds in _spans.get() or []:
+        totals[stage][0] += 1
+        totals[stage][1] += seconds
+    return ", ".join(f"{stage} {count}x {seconds * 1000:.1f}ms" for stage, (count, seconds) in totals.items())
+
+
+def _usage(response) -> tuple[int, int] | None:
+    raw = getattr(response, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+class LLMMetricsHandler(BaseEventHandler):
+    """
+    Times every LLM call and counts its tokens from llama_index instrumentation events.
+
+    Token counts come from the provider's usage report when present; streamed
+    responses usually have none, so they are counted with the default tokenizer.
+    """
+
+    starts: dict = {}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMMetricsHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> Any:
+        if isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+            self.starts[event.span_id] = time.perf_counter()
+        elif isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+            start = self.starts.pop(event.span_id, None)
+            if start is not None:
+                observe("llm", time.perf_counter() - start)
+            if event.response is None:
+                return
+
+            usage = _usage(event.response)
+            if usage is None:
+                tokenizer = get_tokenizer()
+                if isinstance(event, LLMChatEndEvent):
+                    prompt = "\n".join(str(message.content or "") for message in event.messages)
+                    completion = event.response.message.content or ""
+                else:
+                    prompt, completion = event.prompt, event.response.text
+                usage = len(tokenizer(prompt)), len(tokenizer(completion))
+            LLM_TOKENS.labels("prompt").inc(usage[0])
+            LLM_TOKENS.labels("completion").inc(usage[1])
+
+
+get_dispatcher().add_event_handler(LLMMetricsHandler())
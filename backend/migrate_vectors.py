@@ -0,0 +1,90 @@
+"""
+Move Chroma vectors into the configured vector layout.
+
+Usage:
+    python migrate_vectors.py [--batch-size N] [--keep-old]
+
+Set the target first: VECTOR_LAYOUT=shared moves per-document collections into
+SHARED_COLLECTION, and VECTOR_PRECISION=float16 or int8 moves Chroma vectors
+(per-document collections, or a document's rows of the shared collection)
+into the compact store, laid out per VECTOR_LAYOUT.
+
+Every leaf vector of every registered document is copied, embedding included,
+and tagged with its document name, so nothing is embedded again. Copies are
+upserts, so an interrupted run can simply be started again. A document's old
+vectors are dropped once its copy is verified, unless --keep-old is given.
+Restart the servers with the same settings afterwards.
+"""
+import os
+import argparse
+import chromadb
+from dotenv import load_dotenv
+from database import init_db, get_all_files
+from compact_vectors import compact_mode
+from vector_layout import (SHARED_COLLECTION, DOCUMENT_KEY, collection_names, shared_layout, count_document_vectors,
+                           add_document_vectors)
+
+load_dotenv()
+
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH")
+
+
+def source_of(client, name: str, existing: set):
+    """Return (collection, where) holding a document's vectors in Chroma, or None if there is nothing to move."""
+    if name in existing and name != SHARED_COLLECTION:
+        return client.get_collection(name), None
+    if compact_mode() and SHARED_COLLECTION in existing:
+        return client.get_collection(SHARED_COLLECTION), {DOCUMENT_KEY: name}
+    return None
+
+
+def migrate_document(client, source, where: dict | None, name: str, batch_size: int) -> int:
+    copied = 0
+    while True:
+        batch = source.get(
+            where=where, include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=copied
+        )
+        if not batch["ids"]:
+            break
+        add_document_vectors(client, name, batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+        copied += len(batch["ids"])
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move Chroma vectors into the configured vector layout.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Vectors copied per request")
+    parser.add_argument("--keep-old", action="store_true", help="Keep the old vectors after copying")
+    args = parser.parse_args()
+
+    if not (shared_layout() or compact_mode()):
+        print("Nothing to do: set VECTOR_LAYOUT=shared and/or VECTOR_PRECISION=float16|int8 first")
+        return
+
+    init_db()
+    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    existing = set(collection_names(client))
+
+    for file in get_all_files():
+        name = os.path.splitext(file["filename"])[0]
+        source = source_of(client, name, existing)
+        if source is None:
+            print(f"{name}: nothing to move, skipping")
+            continue
+
+        collection, where = source
+        copied = migrate_document(client, collection, where, name, args.batch_size)
+        stored = count_document_vectors(client, name)
+        if stored < copied:
+            print(f"{name}: only {stored} of {copied} vectors found after copying, keeping the old ones")
+            continue
+        if not args.keep_old:
+            if where is None:
+                client.delete_collection(name)
+            else:
+                collection.delete(where=where)
+        print(f"{name}: moved {copied} vectors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from sqlite_pool import ConnectionPool
+from utils import file_hash
+
+load_dotenv()
+
+PDF_PARSER = os.getenv("PDF_PARSER", "llmsherpa").lower()
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARSE_MIN_PAGES_PER_WORKER = int(os.getenv("PDF_PARSE_MIN_PAGES_PER_WORKER", "8"))
+LLMSHERPA_API_URL = os.getenv("LLMSHERPA_API_URL")
+PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE_ENABLED", "true").lower() == "true"
+DB_PATH = os.getenv("DB_PATH")
+PARSE_CACHE_PATH = os.getenv(
+    "PARSE_CACHE_PATH",
+    os.path.join(os.path.dirname(DB_PATH or "") or ".", "parse_cache.sqlite3")
+)
+
+
+class PDFParser(ABC):
+    """Turns a PDF into the flat text that gets chunked. name identifies the backend in the parse cache."""
+
+    name = "base"
+
+    @abstractmethod
+    def parse(self, file_path: str) -> str:
+        ...
+
+
+class LLMSherpaParser(PDFParser):
+    """Layout-aware parsing through an LLMSherpa server (one request per document)."""
+
+    name = "llmsherpa"
+
+    def __init__(self, reader=None):
+        if reader is None:
+            from llmsherpa.readers import LayoutPDFReader
+            reader = LayoutPDFReader(LLMSHERPA_API_URL)
+        self.reader = reader
+
+    def parse(self, file_path: str) -> str:
+        return self.reader.read_pdf(path_or_url=file_path).to_text()
+
+
+def _extract_pages(file_path: str, start: int, stop: int) -> list[str]:
+    import pymupdf
+
+    with pymupdf.open(file_path) as document:
+        return [document[i].get_text("text", sort=True).strip() for i in range(start, stop)]
+
+
+class LocalPDFParser(PDFParser):
+    """
+    In-process text extraction with PyMuPDF.
+
+    Documents with enough pages are split into contiguous page ranges that are
+    extracted on a shared process pool of PDF_PARSE_WORKERS processes; short
+    documents are read directly, where starting the work elsewhere would cost
+    more than it saves. Pages are joined with blank lines, in order.
+
+    Opt in with PDF_PARSER=local. Its text differs from LLMSherpa's, so chunks
+    and content hashes of documents ingested with the other backend will not
+    match; re-ingest them after switching.
+    """
+
+    name = "local"
+
+    def __init__(self, workers: int = PDF_PARSE_WORKERS, min_pages_per_worker: int = PDF_PARSE_MIN_PAGES_PER_WORKER):
+        self.workers = max(1, workers)
+        self.min_pages_per_worker = max(1, min_pages_per_worker)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def parse(self, file_path: str) -> str:
+        import pymupdf
+
+        with pymupdf.open(file_path) as document:
+            page_count = document.page_count
+        parts = min(self.workers, page_count // self.min_pages_per_worker)
+        if parts <= 1:
+            pages = _extract_pages(file_path, 0, page_count)
+        else:
+            bounds = [page_count * i // parts for i in range(parts + 1)]
+            futures = [
+                self.pool().submit(_extract_pages, file_path, start, stop)
+                for start, stop in zip(bounds, bounds[1:])
+            ]
+            pages = [page for future in futures for page in future.result()]
+        return "\n\n".join(page for page in pages if page)
+
+
+class ParseCache:
+    """
+    Parsed text keyed on (parser name, sha256 of the PDF bytes).
+
+    Re-indexing an unchanged file, or re-chunking it with a different
+    configuration, reads the text from here instead of parsing the PDF again.
+    """
+
+    def __init__(self, path: str = PARSE_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.pool = ConnectionPool(path, size=1, stage="parse_cache")
+        self.pool.execute("""
+            CREATE TABLE IF NOT EXISTS parsed_pdfs (
+                parser TEXT NOT NULL,
+                pdf_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (parser, pdf_hash)
+            ) WITHOUT ROWID;
+        """)
+
+    def get(self, parser: str, pdf_hash: str) -> str | None:
+        row = self.pool.fetchone("SELECT text FROM parsed_pdfs WHERE parser = ? AND pdf_hash = ?", (parser, pdf_hash))
+        return row[0] if row else None
+
+    def put(self, parser: str, pdf_hash: str, text: str):
+        self.pool.execute(
+            "INSERT OR REPLACE INTO parsed_pdfs (parser, pdf_hash, text) VALUES (?, ?, ?)", (parser, pdf_hash, text)
+        )
+
+
+def make_parser(backend: str = PDF_PARSER) -> PDFParser:
+    if backend == "llmsherpa":
+        return LLMSherpaParser()
+    if backend == "local":
+        return LocalPDFParser()
+    raise ValueError(f"Unknown PDF_PARSER '{backend}', expected 'llmsherpa' or 'local'")
+
+
+def parse_with_cache(parser: PDFParser, file_path: str, cache: ParseCache | None) -> str:
+    """
+    Parse a PDF, reusing the cached text of an identical file parsed by the same backend.
+
+    Args:
+        parser (PDFParser): Backend used on a cache miss.
+        file_path (str): Path to the PDF.
+        cache (ParseCache | None): Cache to consult; None parses unconditionally.
+
+    Returns:
+        str: Full document text.
+    """
+    if cache is None:
+        return parser.parse(file_path)
+    pdf_hash = file_hash(file_path)
+    text = cache.get(parser.name, pdf_hash)
+    if text is None:
+        text = parser.parse(file_path)
+        cache.put(parser.name, pdf_hash, text)
+    return text
@@ -1,19 +1,31 @@
 import os
+import time
+import asyncio
 import chromadb
 import math
-from llmsherpa.readers import LayoutPDFReader
+from collections import Counter
 from llama_index.core import Document
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.vector_stores.chroma import ChromaVectorStore
+from llama_index.core import VectorStoreIndex
 from llama_index.core import Settings
 from llama_index.core.node_parser import HierarchicalNodeParser, get_leaf_nodes
 from llama_index.core.tools import QueryEngineTool
-from llama_index.core import load_index_from_storage
+from llama_index.core.schema import QueryBundle, MetadataMode
 from llama_index.llms.openai import OpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.core.agent.workflow import ReActAgent, ToolCallResult, AgentStream
+from llama_index.core.agent.workflow import ReActAgent, ToolCall, ToolCallResult, AgentStream, AgentInput, AgentOutput
 from dotenv import load_dotenv
-from utils import make_automerging_index_tool
+from utils import make_automerging_index_tool, file_hash, match_nodes, RETRIEVAL_TOP_K, RERANK_TOP_N
+from reranker import rerank_groups
+from pdf_parser import make_parser, parse_with_cache, ParseCache, PARSE_CACHE_ENABLED
+from vector_layout import (document_vector_store, stored_embeddings, document_filters, tag_document,
+                           delete_document_vectors, evict_document_vectors, shared_layout, DOCUMENT_KEY)
+from docstore import load_storage_context, persist_storage_context, delete_storage, evict_cached_nodes
+from tool_router import tool_router, drug_name
+from embedding_cache import CachedEmbedding, EMBEDDING_CACHE_ENABLED
+from conversation_memory import format_history
+from answer_cache import answer_cache, normalize_query, ANSWER_CACHE_ENABLED
+from metrics import span, observe, log, QUERY_PATHS
+from database import run_db, record_tool_usage
 from ragas import evaluate
 from ragas.metrics import (
     faithfulness,
@@ -28,7 +40,6 @@ from datasets import Dataset
 load_dotenv()
 
 CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH")
-STORAGE_CONTEXT_PATH = os.getenv("STORAGE_CONTEXT_PATH")
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME")
 LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME")
 EVALUATE_MODEL_NAME = os.getenv("EVALUATE_MODEL_NAME")
@@ -36,22 +47,34 @@ EMBEDDING_MODEL_NAME_OPENAI = os.getenv("EMBEDDING_MODEL_NAME_OPENAI")
 LLM_MODEL_NAME_OPENAI = os.getenv("LLM_MODEL_NAME_OPENAI")
 EVALUATE_MODEL_NAME_OPENAI = os.getenv("EVALUATE_MODEL_NAME_OPENAI")
 BASE_URL = os.getenv("BASE_URL")
-LLMSHERPA_API_URL = os.getenv("LLMSHERPA_API_URL")
 API_KEY = os.getenv("API_KEY")
 PROMPT = os.getenv("PROMPT")
+DIRECT_MODE_ENABLED = os.getenv("DIRECT_MODE_ENABLED", "true").lower() == "true"
+DIRECT_MODE_MIN_SCORE = float(os.getenv("DIRECT_MODE_MIN_SCORE", "0.5"))
+DIRECT_MODE_MIN_MARGIN = float(os.getenv("DIRECT_MODE_MIN_MARGIN", "0.05"))
+PARALLEL_MODE_ENABLED = os.getenv("PARALLEL_MODE_ENABLED", "true").lower() == "true"
+PARALLEL_MODE_MAX_TOOLS = int(os.getenv("PARALLEL_MODE_MAX_TOOLS", "6"))
 
 Settings.embed_model = OpenAIEmbedding(model=EMBEDDING_MODEL_NAME_OPENAI, api_key=API_KEY)
+if EMBEDDING_CACHE_ENABLED:
+    Settings.embed_model = CachedEmbedding(Settings.embed_model)
 Settings.llm = OpenAI(model=LLM_MODEL_NAME_OPENAI, api_key=API_KEY)
 evaluate_llm = OpenAI(model=EVALUATE_MODEL_NAME_OPENAI, api_key=API_KEY)
 
 chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
 
-reader = LayoutPDFReader(LLMSHERPA_API_URL)
+pdf_parser = make_parser()
+parse_cache = ParseCache() if PARSE_CACHE_ENABLED else None
+
+query_path_counts = Counter()
 
 def load_query_tool(name: str, description: str) -> QueryEngineTool:
     """
     Load an existing index from ChromaDB and return a QueryEngineTool.
 
+    Nothing is read from the docstore here; parent nodes are fetched on demand
+    when auto-merging needs them.
+
     Args:
         name (str): Name of the document collection.
         description (str): Short summary of the document content.
@@ -59,133 +82,572 @@ def load_query_tool(name: str, description: str) -> QueryEngineTool:
     Returns:
         QueryEngineTool: Tool used for querying the indexed documents.
     """
-    chroma_collection = chroma_client.get_or_create_collection(name)
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(
-        vector_store=vector_store,
-        persist_dir=f"{STORAGE_CONTEXT_PATH}/{name}"
-    )
+    vector_store = document_vector_store(chroma_client, name)
+    storage_context = load_storage_context(name, vector_store)
 
-    automerging_index = load_index_from_storage(storage_context=storage_context)
-    return make_automerging_index_tool(automerging_index, name, description)
+    automerging_index = VectorStoreIndex(nodes=[], storage_context=storage_context)
+    return make_automerging_index_tool(automerging_index, name, description, document_filters([name]))
 
 
-def handle_upload(file_path: str, name: str) -> tuple[QueryEngineTool, str]:
+def reset_vector_client():
     """
-    Handle PDF upload, parse document, build vector and summary indexes, and return a query tool.
+    Reopen ChromaDB so vectors written by other processes are served.
+
+    A client keeps each collection's HNSW index in memory and never sees other
+    processes' writes to it; only a new client reads them from disk. Tools loaded
+    before the reset keep querying the old indexes, so the tools of documents
+    changed since must be reloaded.
+    """
+    global chroma_client
+    chroma_client.clear_system_cache()
+    chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+
+
+def parse_pdf(file_path: str) -> str:
+    """
+    Parse a PDF with the configured backend (PDF_PARSER) and return its flattened text.
+
+    Text is cached by the PDF's content hash, so an unchanged file is only parsed once.
 
     Args:
-        file_path (str): Path to the uploaded PDF.
-        name (str): Name/identifier for the document collection.
+        file_path (str): Path to the PDF.
 
     Returns:
-        tuple: (QueryEngineTool, document description summary)
+        str: Full document text.
+    """
+    return parse_with_cache(pdf_parser, file_path, parse_cache)
 
-    Raises:
-        ValueError: If there is an error during processing.
+
+def chunk_text(text: str) -> tuple[list, list]:
     """
-    try:
-        documents = reader.read_pdf(path_or_url=file_path)
-        full_text = documents.to_text()
-        
-        document = Document(text=full_text)
+    Split document text into hierarchical nodes.
 
-        node_parser = HierarchicalNodeParser.from_defaults(
-            chunk_sizes=[2048, 1024, 256] 
-        )
+    Returns:
+        tuple: (all nodes across the 2048/1024/256 levels, leaf nodes)
+    """
+    node_parser = HierarchicalNodeParser.from_defaults(
+        chunk_sizes=[2048, 1024, 256] 
+    )
 
-        all_nodes = node_parser.get_nodes_from_documents([document]) 
-        leaf_nodes = get_leaf_nodes(all_nodes)
+    all_nodes = node_parser.get_nodes_from_documents([Document(text=text)]) 
+    return all_nodes, get_leaf_nodes(all_nodes)
 
-        chroma_collection = chroma_client.get_or_create_collection(name)
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
 
-        batch_size = 166
-        batches = [leaf_nodes[i:i+batch_size] for i in range(0, len(leaf_nodes), batch_size)]
+def build_index(name: str, all_nodes: list, leaf_nodes: list, progress=None) -> VectorStoreIndex:
+    """
+    Write leaf nodes to the document's Chroma collection (see VECTOR_LAYOUT) and all nodes to its docstore.
 
-        automerging_index = VectorStoreIndex(
-            batches[0],
-            storage_context=storage_context,
-            use_async=True,
-            show_progress=True
-        )
+    Leaf nodes that already carry an embedding are stored as-is; the rest are embedded
+    with Settings.embed_model in batches. Vectors left by an earlier build of the same
+    document, e.g. an interrupted ingestion, are removed first.
+
+    Args:
+        name (str): Name/identifier for the document collection.
+        all_nodes (list): Every hierarchical node, stored in the docstore for auto-merging.
+        leaf_nodes (list): Leaf nodes to store in the vector store.
+        progress (callable, optional): Called as progress(stage, percent) as indexing advances.
+
+    Returns:
+        VectorStoreIndex: The index backed by the new collection.
+    """
+    def report(stage, percent):
+        if progress:
+            progress(stage, percent)
+
+    delete_document_vectors(chroma_client, name)
+    vector_store = document_vector_store(chroma_client, name)
+    storage_context = load_storage_context(name, vector_store, create=True)
+    tag_document(all_nodes, name)
+
+    batch_size = 166
+    batches = [leaf_nodes[i:i+batch_size] for i in range(0, len(leaf_nodes), batch_size)]
+    report("embedding", 30)
+
+    automerging_index = VectorStoreIndex(
+        batches[0],
+        storage_context=storage_context,
+        use_async=True,
+        show_progress=True
+    )
+
+    report("embedding", 30 + 60 / len(batches))
+
+    for i in range(1, len(batches)):
+        automerging_index.insert_nodes(batches[i])
+        report("embedding", 30 + 60 * (i + 1) / len(batches))
+
+    report("persisting", 90)
+    storage_context.docstore.add_documents(all_nodes)
+    persist_storage_context(name, storage_context)
+    return automerging_index
 
-        for i in range(1, len(batches)):
-            automerging_index.insert_nodes(batches[i])
-        
-        storage_context.docstore.add_documents(all_nodes)
-        storage_context.persist(persist_dir=f"{STORAGE_CONTEXT_PATH}/{name}")
 
-        description_text = f"""This document provides comprehensive information about {name}.
+def describe_document(name: str) -> str:
+    """Return the tool description stored in pdf_files for a document."""
+    return f"""This document provides comprehensive information about {name}.
                      It includes details on the intended use, recommended dosage, methods of administration, potential side effects, 
                      interactions with other drugs, contraindications, precautions, and safety guidelines. The document is intended to serve as a complete 
                      reference for understanding how {name} should be used, what benefits it offers, and what risks or 
                      considerations should be kept in mind. Additional information may include storage instructions, 
                      patient guidance, and clinical notes relevant to {name}."""
-        
-        return make_automerging_index_tool(automerging_index, name, description_text), description_text
+
+
+def handle_upload(file_path: str, name: str, progress=None) -> tuple[QueryEngineTool, str]:
+    """
+    Handle PDF upload, parse document, build vector and summary indexes, and return a query tool.
+
+    Args:
+        file_path (str): Path to the uploaded PDF.
+        name (str): Name/identifier for the document collection.
+        progress (callable, optional): Called as progress(stage, percent) as ingestion advances.
+
+    Returns:
+        tuple: (QueryEngineTool, document description summary)
+
+    Raises:
+        ValueError: If there is an error during processing.
+    """
+    try:
+        if progress:
+            progress("parsing", 0)
+        with span("ingest_parse"):
+            full_text = parse_pdf(file_path)
+
+        if progress:
+            progress("chunking", 20)
+        all_nodes, leaf_nodes = chunk_text(full_text)
+
+        with span("ingest_index"):
+            automerging_index = build_index(name, all_nodes, leaf_nodes, progress)
+        description_text = describe_document(name)
+
+        answer_cache.invalidate(f"drug_{name}")
+        tool = make_automerging_index_tool(automerging_index, name, description_text, document_filters([name]))
+        return tool, description_text
     except Exception as e:
         error_msg = f"Error processing {name}: {str(e)}"
-        print(error_msg)
+        log(error_msg)
         raise ValueError(error_msg) from e
     
-def delete_document(name: str):
+def update_document(file_path: str, previous_path: str, name: str, progress=None) -> tuple[QueryEngineTool | None, dict]:
     """
-    Delete a document collection from ChromaDB.
+    Re-index a changed PDF, touching only the nodes whose content differs.
+
+    The new hierarchy is matched against the persisted one by content hash. Unchanged
+    nodes keep their ids and vectors, new leaves are embedded and inserted, stale
+    nodes are removed from the vector store and docstore.
 
     Args:
-        name (str): Name of the document collection to delete.
+        file_path (str): Path to the new version of the PDF.
+        previous_path (str): Path to the currently indexed version.
+        name (str): Name/identifier for the document collection.
+        progress (callable, optional): Called as progress(stage, percent) as re-indexing advances.
+
+    Returns:
+        tuple: (new QueryEngineTool, or None if the PDF is unchanged; counts of added,
+        relinked and removed nodes)
+
+    Raises:
+        ValueError: If there is an error during processing.
     """
-    chroma_client.delete_collection(name)
+    def report(stage, percent):
+        if progress:
+            progress(stage, percent)
 
-async def query_document(query: str, tools: list, chat_history: list[tuple[str, str]]) -> tuple[str, list]:
+    try:
+        if os.path.exists(previous_path) and file_hash(file_path) == file_hash(previous_path):
+            return None, {"unchanged": True}
+
+        report("parsing", 0)
+        full_text = parse_pdf(file_path)
+
+        report("chunking", 20)
+        all_nodes, _ = chunk_text(full_text)
+
+        vector_store = document_vector_store(chroma_client, name)
+        storage_context = load_storage_context(name, vector_store)
+        docstore = storage_context.docstore
+        tag_document(all_nodes, name)
+
+        added, relinked, removed = match_nodes(list(docstore.docs.values()), all_nodes)
+        leaf_ids = {node.node_id for node in get_leaf_nodes(all_nodes)}
+        added_leaves = [node for node in added if node.node_id in leaf_ids]
+        relinked_leaves = [node for node in relinked if node.node_id in leaf_ids]
+
+        report("embedding", 30)
+        if added_leaves:
+            embeddings = Settings.embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in added_leaves]
+            )
+            for node, embedding in zip(added_leaves, embeddings):
+                node.embedding = embedding
+        if relinked_leaves:
+            embeddings = stored_embeddings(chroma_client, name, [node.node_id for node in relinked_leaves])
+            for node in relinked_leaves:
+                node.embedding = embeddings[node.node_id]
+
+        report("persisting", 90)
+        stale = removed + [node.node_id for node in relinked_leaves]
+        if stale:
+            vector_store.delete_nodes(node_ids=stale)
+        if added_leaves or relinked_leaves:
+            vector_store.add(added_leaves + relinked_leaves)
+
+        for node_id in removed:
+            docstore.delete_document(node_id, raise_error=False)
+        docstore.add_documents(all_nodes, allow_update=True)
+        persist_storage_context(name, storage_context)
+
+        answer_cache.invalidate(f"drug_{name}")
+        stats = {
+            "unchanged": False,
+            "added": len(added),
+            "relinked": len(relinked),
+            "removed": len(removed),
+            "embedded": len(added_leaves)
+        }
+        log(f"Re-indexed {name}: {stats}")
+        return load_query_tool(name, describe_document(name)), stats
+    except Exception as e:
+        error_msg = f"Error re-indexing {name}: {str(e)}"
+        log(error_msg)
+        raise ValueError(error_msg) from e
+    
+def delete_document(name: str):
     """
-    Run a structured medical query against a set of tools using ToolRetrieverRouterQueryEngine.
+    Delete a document's vectors and docstore.
 
     Args:
-        query (str): User's medical query.
-        tools (list): List of QueryEngineTools.
-        chat_history (list[tuple[str, str]]): Prior conversation history.
+        name (str): Name of the document collection to delete.
+    """
+    delete_document_vectors(chroma_client, name)
+    delete_storage(name)
+    forget_document(name)
 
-    Returns:
-        tuple: (answer string, list of context nodes used)
+def forget_document(name: str):
     """
+    Drop this process's cached state for a document: its routing embedding,
+    cached answers built from it, cached docstore nodes and in-memory compact vectors.
 
-    agent = ReActAgent(tools=tools, 
-                       llm=Settings.llm, 
-                       system_prompt=PROMPT,
-                       name="MedicalReActAgent", 
-                       description="An agent that answers medical queries using the provided tools only.")
-    
-    history_text = "\n".join([f"User: {user}\nAssistant: {assistant}" for user, assistant in chat_history])
-    query = (
+    Args:
+        name (str): Name of the document collection.
+    """
+    tool_router.remove(f"drug_{name}")
+    answer_cache.invalidate(f"drug_{name}")
+    evict_cached_nodes(name)
+    evict_document_vectors(name)
+
+def direct_prompt(query: str, contexts: dict[str, list[str]], history_text: str) -> str:
+    """Build the single synthesis prompt used by the direct and parallel paths, one context section per tool."""
+    context_text = "\n\n".join(
+        f"Context from {tool_name}:\n" + "\n\n".join(context) for tool_name, context in contexts.items()
+    )
+    return (
+        f"{PROMPT or ''}\n\n"
+        f"{context_text}\n\n"
         f"Conversation history:\n{history_text}\n\n"
         f"Current user question:\n{query}\n"
+        "Answer using only the context above."
     )
+
+async def retrieve_context(tool: QueryEngineTool, query: str) -> list[str]:
+    """Run retrieval and rerank for one tool and return the node texts."""
+    with span("tool_call"):
+        nodes = await tool.query_engine.aretrieve(QueryBundle(query))
+    return [node.node.text for node in nodes]
+
+async def retrieve_contexts(tools: list[QueryEngineTool], query: str) -> list[list[str]]:
+    """
+    Retrieve for several tools at once and rerank all their candidates together.
+
+    The query is embedded once and shared by every retriever, retrieval and
+    auto-merging run concurrently on worker threads, and the merged candidates
+    are scored in one rerank request. Each tool keeps its own top RERANK_TOP_N
+    nodes, as if it had been queried alone.
+
+    Returns:
+        list[list[str]]: Node texts per tool, in the order of tools.
+    """
+    embedding = await Settings.embed_model.aget_query_embedding(query)
+    groups = await _retrieve_nodes(tools, QueryBundle(query, embedding=embedding))
+    ranked = await asyncio.to_thread(rerank_groups, query, groups, RERANK_TOP_N)
+    return [[node.node.text for node in nodes] for nodes in ranked]
+
+async def _retrieve_nodes(tools: list[QueryEngineTool], bundle: QueryBundle, stage: str = "tool_call") -> list[list]:
+    """Run each tool's auto-merging retriever (no rerank) concurrently on worker threads."""
+    def retrieve(tool):
+        with span(stage):
+            return tool.query_engine.retriever.retrieve(bundle)
+
+    return await asyncio.gather(*[asyncio.to_thread(retrieve, tool) for tool in tools])
+
+async def _retrieve_shared(tools: list[QueryEngineTool], bundle: QueryBundle) -> list[list]:
+    """
+    Retrieve for several documents with one filtered query on the shared collection,
+    then auto-merge each document's leaves with its own tool's retriever.
+    """
+    names = [drug_name(tool) for tool in tools]
+    index = VectorStoreIndex.from_vector_store(document_vector_store(chroma_client, names[0]))
+    retriever = index.as_retriever(similarity_top_k=RETRIEVAL_TOP_K * len(names), filters=document_filters(names))
+    with span("search_retrieval"):
+        nodes = await asyncio.to_thread(retriever.retrieve, bundle)
+
+    by_document = {name: [] for name in names}
+    for node in nodes:
+        by_document.setdefault(node.node.metadata.get(DOCUMENT_KEY), []).append(node)
+    return await asyncio.gather(*[
+        asyncio.to_thread(tool.query_engine.retriever.merge, by_document[name]) for tool, name in zip(tools, names)
+    ])
+
+async def search_documents(query: str, tools: list[QueryEngineTool], top_n: int = 10, route: bool = True) -> list[dict]:
+    """
+    Find the passages most relevant to a query across documents, without calling the LLM.
+
+    The query is embedded once; that embedding picks the candidate documents
+    (the tool router's exact matches plus the most similar descriptions) and is
+    shared by their retrievers, which run concurrently with auto-merging. In the
+    shared vector layout a single filtered ANN query covers every candidate
+    document instead. Passages contained in another returned passage (a leaf
+    next to its merged parent) are dropped, and the rest are ranked together by
+    a single cross-encoder pass.
+
+    Args:
+        query (str): Search text.
+        tools (list): Loaded QueryEngineTools.
+        top_n (int): Passages to return.
+        route (bool): Pre-select documents with the tool router; False searches every document.
+
+    Returns:
+        list[dict]: Passages, best first, with document, score, text and character position.
+    """
+    if not tools:
+        return []
+    with span("search_embed"):
+        embedding = await Settings.embed_model.aget_query_embedding(query)
+    if route:
+        tools = await tool_router.route(query, tools, query_embedding=embedding)
+
+    bundle = QueryBundle(query, embedding=embedding)
+    if shared_layout():
+        groups = await _retrieve_shared(tools, bundle)
+    else:
+        groups = await _retrieve_nodes(tools, bundle, stage="search_retrieval")
+    # Auto-merging can return a parent along with some of its own leaves; keep only the parent.
+    groups = await asyncio.gather(*[
+        asyncio.to_thread(tool.query_engine.retriever.drop_contained, nodes) for tool, nodes in zip(tools, groups)
+    ])
+    documents = {
+        node.node.node_id: drug_name(tool)
+        for tool, nodes in zip(tools, groups) for node in nodes
+    }
+    [ranked] = await asyncio.to_thread(rerank_groups, query, [[node for nodes in groups for node in nodes]], top_n)
+    return [
+        {
+            "document": documents[node.node.node_id],
+            "score": node.score,
+            "text": node.node.text,
+            "position": {"start_char": node.node.start_char_idx, "end_char": node.node.end_char_idx},
+        }
+        for node in ranked
+    ]
+
+async def stream_query_document(query: str, tools: list, chat_history: list[tuple[str, str]], summary: str = ""):
+    """
+    Run a medical query and yield progress events while the answer is generated.
+
+    Events are dicts with a "type" key:
+        - "tool_call": a tool is about to run (tool_name, tool_kwargs)
+        - "tool_result": a tool finished (tool_name, context)
+        - "token": an LLM text delta (delta)
+        - "final": the full answer (response, context, and "cached" on a cache hit); always the last event
+
+    Closing the generator early (e.g. on client disconnect) cancels the agent run.
+
+    Args:
+        query (str): User's medical query.
+        tools (list): List of QueryEngineTools.
+        chat_history (list[tuple[str, str]]): Recent conversation turns not covered by the summary.
+        summary (str, optional): Running summary of older turns.
+    """
+    sources = set()
+    async for event in _stream_cached_answer(query, tools, chat_history, summary):
+        if event["type"] == "tool_call":
+            sources.add(event["tool_name"])
+        if event["type"] == "final" and sources and not event.get("error"):
+            try:
+                await run_db(record_tool_usage, sorted(sources))
+            except Exception as e:
+                log(f"Failed to record tool usage: {e}")
+        yield event
+
+async def _stream_cached_answer(query: str, tools: list, chat_history: list[tuple[str, str]], summary: str = ""):
+    # Any question asked within a conversation may depend on it, even one naming
+    # a drug ("and for ibuprofen?"), so only standalone questions use the cache.
+    if not ANSWER_CACHE_ENABLED or chat_history or summary:
+        async for event in _stream_answer(query, tools, chat_history, summary):
+            yield event
+        return
+
+    with span("answer_cache_lookup"):
+        try:
+            embedding = await Settings.embed_model.aget_query_embedding(normalize_query(query))
+        except Exception as e:
+            log(f"Answer cache lookup failed: {e}")
+            embedding = None
+
+        # A near-identical question about another drug must not reuse this drug's answer.
+        drugs = [tool.metadata.name for tool in tool_router.exact_matches(query, tools)]
+        cached = answer_cache.get(embedding, [tool.metadata.name for tool in tools], drugs) if embedding is not None else None
+    if cached:
+        query_path_counts["cache"] += 1
+        QUERY_PATHS.labels("cache").inc()
+        yield {"type": "tool_result", "tool_name": None, "context": cached["context"]}
+        yield {"type": "token", "delta": cached["response"]}
+        yield {"type": "final", "response": cached["response"], "context": cached["context"], "cached": True}
+        return
+
+    sources = set()
+    async for event in _stream_answer(query, tools, chat_history, summary):
+        if event["type"] == "tool_call":
+            sources.add(event["tool_name"])
+        # An answer built from no tool would outlive the documents later added for it.
+        if event["type"] == "final" and embedding is not None and sources and not event.get("error"):
+            answer_cache.put(embedding, event["response"], event["context"], sources, drugs)
+        yield event
+
+async def _stream_answer(query: str, tools: list, chat_history: list[tuple[str, str]], summary: str = ""):
+    history_text = format_history(summary, chat_history)
+    # Drugs named in the question decide its tools. A follow-up that names none
+    # ("what's its max dose?") usually names its drug in an earlier turn, so only
+    # then are tools picked from the summary and recent user turns as well.
+    follow_up = bool(chat_history or summary) and not tool_router.exact_matches(query, tools)
+    routing_query = "\n".join([summary, *(user for user, _ in chat_history), query]).strip() if follow_up else query
+
     try:
+        path, planned, contexts, context = None, [], [], []
+        if DIRECT_MODE_ENABLED:
+            # For a follow-up only a named drug resolves; similarity over several
+            # turns is too weak a signal to skip the agent.
+            tool = await tool_router.resolve(
+                routing_query, tools, DIRECT_MODE_MIN_SCORE, DIRECT_MODE_MIN_MARGIN, by_similarity=not follow_up
+            )
+            if tool is not None:
+                try:
+                    path, planned, contexts = "direct", [tool], [await retrieve_context(tool, query)]
+                except Exception as e:
+                    log(f"Direct path failed for {tool.metadata.name}, falling back to agent: {e}")
+
+        if path is None and PARALLEL_MODE_ENABLED:
+            # A question naming several drugs needs each of their tools; plan those
+            # calls up front and run them together instead of one per agent step.
+            named = tool_router.exact_matches(routing_query, tools)
+            if 1 < len(named) <= PARALLEL_MODE_MAX_TOOLS:
+                try:
+                    path, planned, contexts = "parallel", named, await retrieve_contexts(named, query)
+                except Exception as e:
+                    log(f"Parallel path failed for {[tool.metadata.name for tool in named]}, falling back to agent: {e}")
+
+        if path is not None:
+            query_path_counts[path] += 1
+            QUERY_PATHS.labels(path).inc()
+            log(f"{path.capitalize()} path via {', '.join(tool.metadata.name for tool in planned)}")
+            for tool in planned:
+                yield {"type": "tool_call", "tool_name": tool.metadata.name, "tool_kwargs": {"input": query}}
+            for tool, tool_context in zip(planned, contexts):
+                context.extend(tool_context)
+                yield {"type": "tool_result", "tool_name": tool.metadata.name, "context": tool_context}
+
+            chunks = []
+            sections = {tool.metadata.name: tool_context for tool, tool_context in zip(planned, contexts)}
+            stream = await Settings.llm.astream_complete(direct_prompt(query, sections, history_text))
+            async for chunk in stream:
+                if chunk.delta:
+                    chunks.append(chunk.delta)
+                    yield {"type": "token", "delta": chunk.delta}
+            yield {"type": "final", "response": "".join(chunks), "context": context}
+            return
+
+        query_path_counts["agent"] += 1
+        QUERY_PATHS.labels("agent").inc()
+        tools = await tool_router.route(routing_query, tools)
+
+        agent = ReActAgent(tools=tools, 
+                           llm=Settings.llm, 
+                           system_prompt=PROMPT,
+                           name="MedicalReActAgent", 
+                           description="An agent that answers medical queries using the provided tools only.")
+
+        query = (
+            f"Conversation history:\n{history_text}\n\n"
+            f"Current user question:\n{query}\n"
+        )
         handler = agent.run(query)
-        context = []
-        async for ev in handler.stream_events():
-            if isinstance(ev, ToolCallResult):
-                print(f"\nCall {ev.tool_name} with {ev.tool_kwargs}\nReturned: {ev.tool_output}")
-                raw = getattr(ev.tool_output, 'raw_output', None)
-                if raw and hasattr(raw, 'source_nodes'):
-                    for node_score in raw.source_nodes:
-                        node = getattr(node_score, 'node', None)
-                        if node and hasattr(node, 'text'):
-                            context.append(node.text)
-            if isinstance(ev, AgentStream):
-                print(f"{ev.delta}", end="", flush=True)
-
-        response = await handler
-        print(context)
-        return str(response), context
+        step_started, tool_started = None, {}
+        try:
+            async for ev in handler.stream_events():
+                if isinstance(ev, AgentInput):
+                    step_started = time.perf_counter()
+                elif isinstance(ev, AgentOutput) and step_started is not None:
+                    observe("agent_step", time.perf_counter() - step_started)
+                    step_started = None
+
+                if isinstance(ev, ToolCallResult):
+                    if ev.tool_id in tool_started:
+                        observe("tool_call", time.perf_counter() - tool_started.pop(ev.tool_id))
+                    log(f"Call {ev.tool_name} with {ev.tool_kwargs}\nReturned: {ev.tool_output}")
+                    tool_context = []
+                    raw = getattr(ev.tool_output, 'raw_output', None)
+                    if raw and hasattr(raw, 'source_nodes'):
+                        for node_score in raw.source_nodes:
+                            node = getattr(node_score, 'node', None)
+                            if node and hasattr(node, 'text'):
+                                tool_context.append(node.text)
+                    context.extend(tool_context)
+                    yield {"type": "tool_result", "tool_name": ev.tool_name, "context": tool_context}
+                elif isinstance(ev, ToolCall):
+                    tool_started[ev.tool_id] = time.perf_counter()
+                    yield {"type": "tool_call", "tool_name": ev.tool_name, "tool_kwargs": ev.tool_kwargs}
+                elif isinstance(ev, AgentStream) and ev.delta:
+                    yield {"type": "token", "delta": ev.delta}
+
+            response = await handler
+        finally:
+            if not handler.done():
+                await handler.cancel_run()
+
+        yield {"type": "final", "response": str(response), "context": context}
     except Exception as e:
-        return (
-            "I encountered an error processing your request. "
-            f"Please try rephrasing your question or ask about a different topic: {e}", []
-        )
+        yield {
+            "type": "final",
+            "response": (
+                "I encountered an error processing your request. "
+                f"Please try rephrasing your question or ask about a different topic: {e}"
+            ),
+            "context": [],
+            "error": str(e)
+        }
+
+async def query_document(query: str, tools: list, chat_history: list[tuple[str, str]], summary: str = "") -> tuple[str, list]:
+    """
+    Run a structured medical query against a set of tools and wait for the full answer.
+
+    Args:
+        query (str): User's medical query.
+        tools (list): List of QueryEngineTools.
+        chat_history (list[tuple[str, str]]): Recent conversation turns not covered by the summary.
+        summary (str, optional): Running summary of older turns.
+
+    Returns:
+        tuple: (answer string, list of context nodes used)
+    """
+    response, context = "", []
+    async for event in stream_query_document(query, tools, chat_history, summary):
+        if event["type"] == "token":
+            print(event["delta"], end="", flush=True)
+        elif event["type"] == "final":
+            response, context = event["response"], event["context"]
+    log(f"Context: {context}")
+    return response, context
 
 def evaluate_sample(question: str, context: list[str], answer: str, ground_truth: str):
     """
@@ -0,0 +1,51 @@
+import os
+from dotenv import load_dotenv
+from database import run_db, get_registry_version, get_document_changes
+
+load_dotenv()
+
+REGISTRY_POLL_SECONDS = float(os.getenv("REGISTRY_POLL_SECONDS", "2"))
+
+
+class DocumentRegistry:
+    """
+    This worker's position in the shared document registry.
+
+    Every change to pdf_files is logged in document_changes with an increasing
+    version. Each worker remembers the last version it applied and periodically
+    asks for newer changes, skipping the ones it made itself.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._own = set()
+
+    async def snapshot(self):
+        """Mark the registry as applied up to now; call before loading the current documents."""
+        self.version = await run_db(get_registry_version)
+
+    def applied(self, version: int):
+        """Record a change this worker made and already reflects locally."""
+        self._own.add(version)
+
+    async def pending_changes(self) -> dict[str, str]:
+        """
+        Return changes made by other workers since the last call.
+
+        Returns:
+            dict: {filename: latest action}, where action is "upsert", "update" or "delete".
+        """
+        rows = await run_db(get_document_changes, self.version)
+        changes = {}
+        for version, filename, action in rows:
+            if version in self._own:
+                self._own.discard(version)
+                changes.pop(filename, None)
+            else:
+                changes[filename] = action
+        if rows:
+            self.version = rows[-1][0]
+        return changes
+
+
+document_registry = DocumentRegistry()
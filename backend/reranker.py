@@ -0,0 +1,153 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import List, Optional
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from dotenv import load_dotenv
+from metrics import span, RERANK_BATCH_PAIRS
+
+load_dotenv()
+
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_MAX_BATCH_SIZE = int(os.getenv("RERANK_MAX_BATCH_SIZE", "64"))
+RERANK_MAX_WAIT_MS = float(os.getenv("RERANK_MAX_WAIT_MS", "10"))
+RERANK_NUM_THREADS = int(os.getenv("RERANK_NUM_THREADS", "0"))
+
+
+class RerankService:
+    """
+    Process-wide cross-encoder shared by every document tool.
+
+    Scoring requests from concurrent callers are queued and merged into a single
+    forward pass of up to RERANK_MAX_BATCH_SIZE (query, passage) pairs, waiting at
+    most RERANK_MAX_WAIT_MS for more requests to arrive.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(RerankService, cls).__new__(cls)
+                instance._start()
+                cls._instance = instance
+        return cls._instance
+
+    def _load_model(self):
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        if RERANK_NUM_THREADS > 0:
+            torch.set_num_threads(RERANK_NUM_THREADS)
+
+        return CrossEncoder(RERANK_MODEL_NAME, max_length=512)
+
+    def _start(self):
+        self.model = self._load_model()
+        self.max_batch_size = max(1, RERANK_MAX_BATCH_SIZE)
+        self.max_wait = RERANK_MAX_WAIT_MS / 1000
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="rerank-worker", daemon=True)
+        self.worker.start()
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        """
+        Score passages against a query, blocking until the batch they join is done.
+
+        Args:
+            query (str): Query text.
+            passages (list[str]): Passages to score.
+
+        Returns:
+            list[float]: One relevance score per passage, in input order.
+        """
+        if not passages:
+            return []
+        future = Future()
+        self.requests.put(([(query, passage) for passage in passages], future))
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            pairs = [pair for item_pairs, _ in batch for pair in item_pairs]
+            RERANK_BATCH_PAIRS.observe(len(pairs))
+            try:
+                scores = self.model.predict(pairs, batch_size=self.max_batch_size, show_progress_bar=False)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for item_pairs, future in batch:
+                future.set_result([float(s) for s in scores[offset:offset + len(item_pairs)]])
+                offset += len(item_pairs)
+
+
+class SharedRerank(BaseNodePostprocessor):
+    """Node postprocessor that reranks through the shared RerankService."""
+
+    top_n: int = 4
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SharedRerank"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+
+        return rerank_groups(query_bundle.query_str, [nodes], self.top_n)[0]
+
+
+def rerank_groups(query: str, groups: List[List[NodeWithScore]], top_n: int) -> List[List[NodeWithScore]]:
+    """
+    Rerank several candidate lists against the same query in a single scoring request.
+
+    Args:
+        query (str): Query text.
+        groups (list[list[NodeWithScore]]): Candidate nodes, e.g. one list per document.
+        top_n (int): Nodes kept per group, so every group stays represented.
+
+    Returns:
+        list[list[NodeWithScore]]: Each group's top_n nodes, best first.
+    """
+    passages = [node.node.get_content(metadata_mode=MetadataMode.EMBED) for group in groups for node in group]
+    if not passages:
+        return [[] for _ in groups]
+    with span("rerank"):
+        scores = RerankService().score(query, passages)
+
+    ranked, offset = [], 0
+    for group in groups:
+        for node, score in zip(group, scores[offset:offset + len(group)]):
+            node.score = score
+        offset += len(group)
+        ranked.append(sorted(group, key=lambda n: n.score or 0.0, reverse=True)[:top_n])
+    return ranked
@@ -0,0 +1,98 @@
+import os
+import asyncio
+import sqlite3
+import threading
+import contextvars
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from metrics import span
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA foreign_keys = ON;",
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS};",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -16000;",
+]
+
+
+class ConnectionPool:
+    """
+    Per-thread SQLite connections with WAL enabled and explicit transactions.
+
+    Every thread gets its own connection, so cursor state such as lastrowid is never
+    shared. Async callers go through run(), which executes on a small dedicated
+    thread pool and therefore reuses at most DB_POOL_SIZE connections. Reads and
+    writes are timed as the "<stage>_read" and "<stage>_write" metrics stages.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE, stage: str = "db"):
+        self.path = path
+        self.stage = stage
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite")
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed statements in one IMMEDIATE transaction on this thread's connection."""
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        with span(f"{self.stage}_write"):
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                yield conn
+                conn.execute("COMMIT;")
+            except BaseException:
+                conn.execute("ROLLBACK;")
+                raise
+
+    def execute(self, query, params=()) -> int:
+        with self.transaction() as conn:
+            return conn.execute(query, params).lastrowid
+
+    def executemany(self, query, seq_of_params):
+        with self.transaction() as conn:
+            conn.executemany(query, seq_of_params)
+
+    def fetchall(self, query, params=()):
+        with span(f"{self.stage}_read"):
+            return self.connection().execute(query, params).fetchall()
+
+    def fetchone(self, query, params=()):
+        with span(f"{self.stage}_read"):
+            return self.connection().execute(query, params).fetchone()
+
+    async def run(self, fn, *args):
+        """Run a blocking database function off the event loop, keeping the caller's trace."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(context.run, fn, *args))
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.tools import QueryEngineTool
+from dotenv import load_dotenv
+from metrics import log
+
+load_dotenv()
+
+TOOL_ROUTER_ENABLED = os.getenv("TOOL_ROUTER_ENABLED", "true").lower() == "true"
+TOOL_ROUTER_TOP_K = int(os.getenv("TOOL_ROUTER_TOP_K", "5"))
+
+
+def drug_name(tool: QueryEngineTool) -> str:
+    """Return the document name behind a drug_<name> tool."""
+    name = tool.metadata.name
+    return name[len("drug_"):] if name.startswith("drug_") else name
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[\W_]+", " ", text.lower()).strip()
+
+
+class ToolRouter:
+    """
+    In-memory vector index over tool descriptions used to pre-select candidate tools.
+
+    Each description is embedded once, the first time its tool is routed, and
+    kept until the tool is removed or its description changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def remove(self, name: str):
+        """Drop a tool from the index by its tool name (drug_<name>)."""
+        with self._lock:
+            self._entries.pop(name, None)
+
+    async def _sync(self, tools: list[QueryEngineTool]):
+        with self._lock:
+            missing = [
+                tool for tool in tools
+                if self._entries.get(tool.metadata.name, (None, None))[0] != tool.metadata.description
+            ]
+        if not missing:
+            return
+
+        embeddings = await Settings.embed_model.aget_text_embedding_batch(
+            [tool.metadata.description for tool in missing]
+        )
+        with self._lock:
+            for tool, embedding in zip(missing, embeddings):
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector /= np.linalg.norm(vector) or 1.0
+                self._entries[tool.metadata.name] = (tool.metadata.description, vector)
+
+    def exact_matches(self, query: str, tools: list[QueryEngineTool]) -> list[QueryEngineTool]:
+        """Return tools whose drug name appears verbatim in the query."""
+        text = f" {_normalize(query)} "
+        return [tool for tool in tools if f" {_normalize(drug_name(tool))} " in text]
+
+    async def similarities(self, query: str, tools: list[QueryEngineTool], query_embedding: list | None = None) -> np.ndarray:
+        """Return the cosine similarity between the query and each tool description."""
+        await self._sync(tools)
+        if query_embedding is None:
+            query_embedding = await Settings.embed_model.aget_query_embedding(query)
+        query_vector = np.array(query_embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        with self._lock:
+            matrix = np.stack([self._entries[tool.metadata.name][1] for tool in tools])
+        return matrix @ query_vector
+
+    async def route(self, query: str, tools: list[QueryEngineTool], top_k: int | None = None,
+                    query_embedding: list | None = None) -> list[QueryEngineTool]:
+        """
+        Select the tools most relevant to a query.
+
+        Args:
+            query (str): Text used for routing (the user question, optionally with recent history).
+            tools (list): All loaded QueryEngineTools.
+            top_k (int, optional): Number of tools picked by similarity. Defaults to TOOL_ROUTER_TOP_K.
+            query_embedding (list, optional): Embedding of query, if the caller already has one.
+
+        Returns:
+            list: Exact drug name matches followed by the top_k most similar tools,
+            or all tools when routing is disabled or fails.
+        """
+        top_k = top_k or TOOL_ROUTER_TOP_K
+        if not TOOL_ROUTER_ENABLED or len(tools) <= top_k:
+            return tools
+
+        selected = self.exact_matches(query, tools)
+        selected_names = {tool.metadata.name for tool in selected}
+        candidates = [tool for tool in tools if tool.metadata.name not in selected_names]
+        if not candidates:
+            return selected
+
+        try:
+            scores = await self.similarities(query, candidates, query_embedding)
+        except Exception as e:
+            log(f"Tool routing failed, falling back to all tools: {e}")
+            return tools
+
+        for i in np.argsort(-scores)[:top_k]:
+            selected.append(candidates[i])
+        return selected
+
+    async def resolve(self, query: str, tools: list[QueryEngineTool], min_score: float, min_margin: float,
+                      by_similarity: bool = True) -> QueryEngineTool | None:
+        """
+        Resolve a query to a single tool when the match is unambiguous.
+
+        A query resolves when it names exactly one drug, or when it names none and the
+        best description similarity is at least min_score and beats the runner-up by
+        at least min_margin. For a follow-up question, pass the earlier turns along
+        with it, as for route(), so a drug named there counts too.
+
+        Args:
+            by_similarity (bool): Also resolve queries that name no drug; pass False for
+                text spanning several conversation turns, whose similarity is unreliable.
+
+        Returns:
+            QueryEngineTool | None: The resolved tool, or None if the query is ambiguous.
+        """
+        if not tools:
+            return None
+
+        exact = self.exact_matches(query, tools)
+        if len(exact) == 1:
+            return exact[0]
+        if exact or not by_similarity:
+            return None
+
+        try:
+            scores = await self.similarities(query, tools)
+        except Exception as e:
+            log(f"Tool resolution failed: {e}")
+            return None
+
+        order = np.argsort(-scores)
+        best = scores[order[0]]
+        runner_up = scores[order[1]] if len(order) > 1 else -1.0
+        if best >= min_score and best - runner_up >= min_margin:
+            return tools[order[0]]
+        return None
+
+
+tool_router = ToolRouter()
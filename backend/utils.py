@@ -1,22 +1,66 @@
+import hashlib
 from llama_index.core.tools import QueryEngineTool
 from llama_index.core.retrievers import AutoMergingRetriever
 from llama_index.core import VectorStoreIndex
-from llama_index.core.postprocessor import SentenceTransformerRerank
 from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import NodeRelationship, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores import MetadataFilters
+from reranker import SharedRerank
+from metrics import span
 
-def make_automerging_index_tool(index: VectorStoreIndex, name: str, description: str) -> QueryEngineTool:
-    """Create a medical-optimized query tool that returns top relevant nodes."""
+RETRIEVAL_TOP_K = 8
+RERANK_TOP_N = 4
 
-    retriever = AutoMergingRetriever(
-        index.as_retriever(similarity_top_k=8),
+
+class TimedAutoMergingRetriever(AutoMergingRetriever):
+    """AutoMergingRetriever that records vector retrieval and parent merging as separate spans."""
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        with span("vector_retrieval"):
+            nodes = self._vector_retriever.retrieve(query_bundle)
+        return self.merge(nodes)
+
+    def merge(self, nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+        """Auto-merge already retrieved leaf nodes into their parents, best first."""
+        with span("auto_merge"):
+            nodes, is_changed = self._try_merging(nodes)
+            while is_changed:
+                nodes, is_changed = self._try_merging(nodes)
+
+        nodes.sort(key=lambda x: x.get_score(), reverse=True)
+        return nodes
+
+    def drop_contained(self, nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+        """Drop repeated nodes and nodes whose parent or further ancestor is also in the list, keeping the order."""
+        ids = {node.node.node_id for node in nodes}
+        seen = set()
+        kept = []
+        for node in nodes:
+            if node.node.node_id in seen or any(ancestor in ids for ancestor in self._ancestors(node.node)):
+                continue
+            seen.add(node.node.node_id)
+            kept.append(node)
+        return kept
+
+    def _ancestors(self, node):
+        parent = node.parent_node
+        while parent is not None:
+            yield parent.node_id
+            parent_node = self._storage_context.docstore.get_node(parent.node_id, raise_error=False)
+            parent = parent_node.parent_node if parent_node is not None else None
+
+
+def make_automerging_index_tool(index: VectorStoreIndex, name: str, description: str,
+                                filters: MetadataFilters | None = None) -> QueryEngineTool:
+    """Create a medical-optimized query tool that returns top relevant nodes, optionally filtered by metadata."""
+
+    retriever = TimedAutoMergingRetriever(
+        index.as_retriever(similarity_top_k=RETRIEVAL_TOP_K, filters=filters),
         storage_context=index.storage_context,
         verbose=True
     )
 
-    rerank = SentenceTransformerRerank(
-        top_n=4,
-        model="cross-encoder/ms-marco-MiniLM-L-6-v2"
-    )
+    rerank = SharedRerank(top_n=RERANK_TOP_N)
 
     query_engine = RetrieverQueryEngine.from_args(
         retriever=retriever,
@@ -27,4 +71,94 @@ def make_automerging_index_tool(index: VectorStoreIndex, name: str, description:
         query_engine=query_engine,
         name=f"drug_{name}",
         description=f"{description}"
-    )
\ No newline at end of file
+    )
+
+def file_hash(path: str) -> str:
+    """Return the sha256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def node_content_keys(nodes: list) -> dict:
+    """
+    Map each hierarchical node id to a content key of its depth and text.
+
+    Depth is part of the key so a parent whose text equals its only child's is
+    not confused with that child.
+    """
+    by_id = {node.node_id: node for node in nodes}
+
+    def depth(node):
+        level = 0
+        while node.parent_node is not None and node.parent_node.node_id in by_id:
+            node = by_id[node.parent_node.node_id]
+            level += 1
+        return level
+
+    return {
+        node.node_id: hashlib.sha256(f"{depth(node)}\n{node.get_content()}".encode("utf-8")).hexdigest()
+        for node in nodes
+    }
+
+
+def _relation_ids(node) -> set:
+    ids = set()
+    for relation, info in node.relationships.items():
+        if relation == NodeRelationship.SOURCE:
+            continue
+        for item in info if isinstance(info, list) else [info]:
+            ids.add((relation, item.node_id))
+    return ids
+
+
+def match_nodes(old_nodes: list, new_nodes: list) -> tuple[list, list, list]:
+    """
+    Reuse ids of unchanged old nodes in a freshly parsed node hierarchy.
+
+    New nodes whose content key matches an old node take over that node's id, and
+    every relationship is rewritten to the reused ids, so unchanged chunks keep their
+    vector store entries.
+
+    Returns:
+        tuple: (new nodes not present before, reused nodes whose relationships changed,
+        ids of old nodes that no longer exist)
+    """
+    old_keys = node_content_keys(old_nodes)
+    new_keys = node_content_keys(new_nodes)
+    old_by_id = {node.node_id: node for node in old_nodes}
+
+    available = {}
+    for node_id, key in old_keys.items():
+        available.setdefault(key, []).append(node_id)
+
+    id_map = {}
+    for node in new_nodes:
+        candidates = available.get(new_keys[node.node_id])
+        if candidates:
+            id_map[node.node_id] = candidates.pop(0)
+
+    source = next((node.relationships.get(NodeRelationship.SOURCE) for node in old_nodes
+                   if NodeRelationship.SOURCE in node.relationships), None)
+    for node in new_nodes:
+        node.id_ = id_map.get(node.node_id, node.node_id)
+        for relation, info in list(node.relationships.items()):
+            if relation == NodeRelationship.SOURCE:
+                if source is not None:
+                    node.relationships[relation] = source
+            elif isinstance(info, list):
+                for item in info:
+                    item.node_id = id_map.get(item.node_id, item.node_id)
+            else:
+                info.node_id = id_map.get(info.node_id, info.node_id)
+
+    reused = set(id_map.values())
+    added = [node for node in new_nodes if node.node_id not in reused]
+    relinked = [
+        node for node in new_nodes
+        if node.node_id in reused and _relation_ids(node) != _relation_ids(old_by_id[node.node_id])
+    ]
+    removed = [node_id for node_id in old_by_id if node_id not in reused]
+    return added, relinked, removed
@@ -0,0 +1,146 @@
+"""
+Where each document's leaf vectors live in Chroma.
+
+per_document (default): one collection per PDF, named after the document.
+shared: every leaf in the SHARED_COLLECTION collection, tagged with the
+document name under DOCUMENT_KEY; per-document access is a metadata filter.
+Existing per-document collections are converted by migrate_vectors.py.
+
+With VECTOR_PRECISION=float16 or int8 the vectors are kept in the compact
+store (compact_vectors.py) instead of Chroma, in the same two layouts.
+"""
+import os
+import json
+from llama_index.core.vector_stores import MetadataFilters, MetadataFilter, FilterOperator
+from llama_index.vector_stores.chroma import ChromaVectorStore
+from compact_vectors import CompactVectorStore, shared_compact_index, evict_compact_vectors, compact_mode, DOCUMENT_KEY
+from dotenv import load_dotenv
+
+load_dotenv()
+
+VECTOR_LAYOUT = os.getenv("VECTOR_LAYOUT", "per_document").lower()
+SHARED_COLLECTION = os.getenv("SHARED_COLLECTION", "leaflets")
+
+
+def shared_layout() -> bool:
+    return VECTOR_LAYOUT == "shared"
+
+
+def document_collection(client, name: str):
+    """Return the Chroma collection holding a document's vectors, creating it if needed."""
+    return client.get_or_create_collection(collection_name(name))
+
+
+def collection_name(name: str) -> str:
+    return SHARED_COLLECTION if shared_layout() else name
+
+
+def document_vector_store(client, name: str):
+    if compact_mode():
+        return CompactVectorStore(collection_name(name))
+    return ChromaVectorStore(chroma_collection=document_collection(client, name))
+
+
+def stored_embeddings(client, name: str, ids: list[str]) -> dict:
+    """Return {node id: embedding} of a document's stored leaves, at full precision."""
+    if compact_mode():
+        return {id: vector.tolist() for id, vector in shared_compact_index().full_vectors(collection_name(name), ids).items()}
+    stored = document_collection(client, name).get(ids=ids, include=["embeddings"])
+    return {id: list(embedding) for id, embedding in zip(stored["ids"], stored["embeddings"])}
+
+
+def evict_document_vectors(name: str):
+    """Forget this process's in-memory copy of a document's vectors so they are re-read from disk."""
+    if compact_mode():
+        evict_compact_vectors(collection_name(name))
+
+
+def document_filters(names: list[str]) -> MetadataFilters | None:
+    """Metadata filter restricting retrieval to the given documents; None outside the shared layout."""
+    if not shared_layout():
+        return None
+    if len(names) == 1:
+        return MetadataFilters(filters=[MetadataFilter(key=DOCUMENT_KEY, value=names[0])])
+    return MetadataFilters(filters=[MetadataFilter(key=DOCUMENT_KEY, value=names, operator=FilterOperator.IN)])
+
+
+def tag_document(nodes: list, name: str):
+    """
+    Record the document name in each node's metadata.
+
+    The key is excluded from embedding and LLM text, so tagging never changes a
+    node's embedding or what the model sees.
+    """
+    for node in nodes:
+        node.metadata[DOCUMENT_KEY] = name
+        if DOCUMENT_KEY not in node.excluded_embed_metadata_keys:
+            node.excluded_embed_metadata_keys.append(DOCUMENT_KEY)
+        if DOCUMENT_KEY not in node.excluded_llm_metadata_keys:
+            node.excluded_llm_metadata_keys.append(DOCUMENT_KEY)
+
+
+def tag_metadata(metadata: dict, name: str) -> dict:
+    """tag_document for a node already serialized Chroma-style: the filterable key and its _node_content."""
+    metadata = dict(metadata or {})
+    metadata[DOCUMENT_KEY] = name
+    if "_node_content" in metadata:
+        node = json.loads(metadata["_node_content"])
+        node.setdefault("metadata", {})[DOCUMENT_KEY] = name
+        for key in ("excluded_embed_metadata_keys", "excluded_llm_metadata_keys"):
+            if DOCUMENT_KEY not in node.setdefault(key, []):
+                node[key].append(DOCUMENT_KEY)
+        metadata["_node_content"] = json.dumps(node, ensure_ascii=False)
+    return metadata
+
+
+def add_document_vectors(client, name: str, ids: list[str], embeddings: list, documents: list, metadatas: list[dict]):
+    """Write already embedded, Chroma-style rows of a document into the configured store."""
+    metadatas = [tag_metadata(metadata, name) for metadata in metadatas]
+    if compact_mode():
+        shared_compact_index().upsert(collection_name(name), ids, embeddings, documents, metadatas)
+    else:
+        document_collection(client, name).upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+
+def read_document_vectors(client, name: str, batch_size: int = 1000):
+    """Yield a document's stored rows from the configured store in batches shaped like Chroma's get."""
+    offset = 0
+    while True:
+        if compact_mode():
+            batch = shared_compact_index().get(
+                collection_name(name), name if shared_layout() else None, limit=batch_size, offset=offset
+            )
+        else:
+            batch = document_collection(client, name).get(
+                where={DOCUMENT_KEY: name} if shared_layout() else None,
+                include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
+            )
+        if not batch["ids"]:
+            return
+        yield batch
+        offset += len(batch["ids"])
+
+
+def collection_names(client) -> list[str]:
+    return [c if isinstance(c, str) else c.name for c in client.list_collections()]
+
+
+def delete_document_vectors(client, name: str):
+    """Remove a document's vectors: its collection, or its rows of the shared collection."""
+    if compact_mode():
+        if shared_layout():
+            shared_compact_index().delete(SHARED_COLLECTION, document=name)
+        else:
+            shared_compact_index().delete(name)
+    elif shared_layout():
+        document_collection(client, name).delete(where={DOCUMENT_KEY: name})
+    if name in collection_names(client) and name != SHARED_COLLECTION:
+        client.delete_collection(name)
+
+
+def count_document_vectors(client, name: str) -> int:
+    if compact_mode():
+        return shared_compact_index().count(collection_name(name), name if shared_layout() else None)
+    if shared_layout():
+        return len(document_collection(client, name).get(where={DOCUMENT_KEY: name}, include=[])["ids"])
+    return client.get_collection(name).count()
@@ -0,0 +1,101 @@
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+from rag import load_query_tool
+from database import run_db, get_tool_usage
+from metrics import span, log
+
+load_dotenv()
+
+TOOL_WARMUP_WORKERS = int(os.getenv("TOOL_WARMUP_WORKERS", "4"))
+
+
+class ToolWarmup:
+    """
+    Loads the document tools at startup on TOOL_WARMUP_WORKERS threads.
+
+    Documents are loaded in order of how often their tool has been called, so the
+    most requested ones become queryable first. A document that fails to load is
+    marked "failed" and does not hold up the others.
+    """
+
+    def __init__(self, workers: int = TOOL_WARMUP_WORKERS):
+        self.workers = max(1, workers)
+        self.states = {}
+        self.started_at = None
+        self.finished_at = None
+
+    async def run(self, files: list[dict], on_loaded):
+        """
+        Load a tool for every file.
+
+        Args:
+            files (list[dict]): pdf_files rows.
+            on_loaded (callable): Called on the event loop with each tool as soon as it is loaded.
+        """
+        self.started_at = time.time()
+        usage = await run_db(get_tool_usage)
+        names = {file["filename"]: os.path.splitext(file["filename"])[0] for file in files}
+        ordered = sorted(files, key=lambda file: usage.get(f"drug_{names[file['filename']]}", 0), reverse=True)
+        for file in ordered:
+            self.states[names[file["filename"]]] = {"status": "pending", "seconds": None, "error": None}
+
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def load(file):
+            async with semaphore:
+                tool = await self.load(names[file["filename"]], file["description"])
+            if tool is not None:
+                on_loaded(tool)
+
+        await asyncio.gather(*[load(file) for file in ordered])
+        self.finished_at = time.time()
+
+    async def load(self, name: str, description: str):
+        """Load one document's tool, recording its state; returns None if loading failed."""
+        state = self.states.setdefault(name, {"status": "pending", "seconds": None, "error": None})
+        if state["status"] != "ready":
+            # A reload keeps serving the previous tool, so the document stays "ready".
+            state.update(status="loading", error=None)
+        start = time.perf_counter()
+        try:
+            with span("tool_load"):
+                tool = await asyncio.to_thread(load_query_tool, name, description)
+        except Exception as e:
+            state.update(status="failed", seconds=time.perf_counter() - start, error=str(e))
+            log(f"Failed to load tool for {name}: {e}")
+            return None
+        state.update(status="ready", seconds=time.perf_counter() - start, error=None)
+        log(f"Tool loaded for {name} in {state['seconds']:.2f}s")
+        return tool
+
+    def set_state(self, name: str, status: str, seconds: float | None = None, error: str | None = None):
+        self.states[name] = {"status": status, "seconds": seconds, "error": error}
+
+    def forget(self, name: str):
+        self.states.pop(name, None)
+
+    def pending(self) -> list[str]:
+        """Documents whose tool is not loaded yet and may still become available."""
+        return [name for name, state in self.states.items() if state["status"] in ("pending", "loading")]
+
+    def unavailable(self) -> list[str]:
+        """Documents whose tool cannot be queried right now, whether still loading or failed."""
+        return [name for name, state in self.states.items() if state["status"] != "ready"]
+
+    def report(self) -> dict:
+        counts = {}
+        for state in self.states.values():
+            counts[state["status"]] = counts.get(state["status"], 0) + 1
+        return {
+            "ready": self.finished_at is not None,
+            "workers": self.workers,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "counts": counts,
+            "documents": self.states
+        }
+
+
+tool_warmup = ToolWarmup()
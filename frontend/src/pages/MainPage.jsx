@@ -843,9 +843,22 @@ function MainPage() {
         throw new Error(errorData.error || "Upload failed");
       }
 
-      fetchFiles();
       const data = await res.json();
       addNotification(data.message || "File uploaded successfully.", "success");
+
+      let job = { status: "queued" };
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const jobRes = await fetch(`${BACKEND_URL}/jobs/${data.job_id}`);
+        if (!jobRes.ok) throw new Error("Failed to fetch upload status");
+        job = await jobRes.json();
+      }
+      if (job.status === "failed") {
+        throw new Error(job.error || "Upload failed");
+      }
+
+      fetchFiles();
+      addNotification(`PDF ${file.name} uploaded successfully!`, "success");
     } catch (err) {
       console.error("Error uploading file:", err);
       addNotification(err.message || "Error uploading file.", "error");